@@ -1,38 +1,176 @@
 # process_data_modal.py
 import modal
+import asyncio
 from datetime import date, timedelta
+import hashlib
+import json
 import os
 import requests
+from requests.adapters import HTTPAdapter
+import sqlite3
+import time
+from urllib3.util.retry import Retry
 
 app = modal.App(name="federal-register-job")
 image = modal.Image.debian_slim(python_version="3.10").pip_install(
-    "requests", "nomic"
+    "requests", "aiohttp", "nomic"
 )
 
-def fetch_data(target_date_str):
-    """Fetches data from Federal Register API for a specific date."""
-    api_url = 'https://www.federalregister.gov/api/v1/documents.json'
-    params = {
+# The sync state lives on a Modal Volume so it survives between scheduled runs.
+volume = modal.Volume.from_name("federal-register-state", create_if_missing=True)
+STATE_DIR = "/state"
+STATE_PATH = f"{STATE_DIR}/federal_register_state.sqlite"
+CACHE_DIR = f"{STATE_DIR}/http_cache"
+
+API_URL = 'https://www.federalregister.gov/api/v1/documents.json'
+LOOKBACK_DAYS = 3
+
+DATE_PARAM = 'conditions[publication_date][is]'
+
+def query_params(target_date_str, page=1):
+    return {
         'per_page': 1000,
+        'page': page,
         'order': 'newest',
-        'conditions[publication_date][is]': target_date_str
+        DATE_PARAM: target_date_str
     }
-    response = requests.get(api_url, params=params, timeout=10)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class DiskCache:
+    """Keeps API responses on disk, keyed by URL and query params.
+
+    Entries younger than `max_age` seconds are served without touching the network. Older ones
+    are revalidated with If-None-Match / If-Modified-Since, so an unchanged page costs a 304 and
+    no body. Anything with the same load/save/is_fresh/validators methods can stand in for it.
+
+    Publication dates on or after `revalidate_since` can still be corrected, so their entries
+    are always revalidated, however young they are."""
+    def __init__(self, directory=CACHE_DIR, max_age=24 * 60 * 60, revalidate_since=None):
+        self.directory = directory
+        self.max_age = max_age
+        self.revalidate_since = revalidate_since
+
+    def path(self, url, params):
+        key = json.dumps([url, sorted((params or {}).items())], default=str)
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def load(self, url, params):
+        try:
+            with open(self.path(url, params)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, url, params, etag, last_modified, body):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = {'fetched_at': time.time(), 'etag': etag, 'last_modified': last_modified, 'body': body}
+        tmp_path = self.path(url, params) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.path(url, params))
+
+    def is_fresh(self, entry, params=None):
+        if self.revalidate_since and (params or {}).get(DATE_PARAM, '') >= self.revalidate_since:
+            return False
+        return time.time() - entry['fetched_at'] < self.max_age
+
+    def validators(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+class NoCache:
+    """Drop-in for DiskCache that always goes to the network."""
+    def load(self, url, params):
+        return None
+
+    def save(self, url, params, etag, last_modified, body):
+        pass
+
+def make_session(retries=5, backoff=0.5):
+    """A pooled session that retries failed GETs with exponential backoff."""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES, allowed_methods=['GET'])
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+session = make_session()
+cache = DiskCache()
+
+def cached_get(url, params=None, session=session, cache=cache):
+    entry = cache.load(url, params)
+    if entry is not None and cache.is_fresh(entry, params):
+        return entry['body']
+    headers = cache.validators(entry) if entry is not None else {}
+    response = session.get(url, params=params, headers=headers, timeout=10)
+    if response.status_code == 304 and entry is not None:
+        cache.save(url, params, entry['etag'], entry['last_modified'], entry['body'])
+        return entry['body']
     response.raise_for_status()
-    return response.json()
+    body = response.json()
+    cache.save(url, params, response.headers.get('ETag'), response.headers.get('Last-Modified'), body)
+    return body
 
-def process_data(target_date_str: str):
+async def cached_get_async(session, url, params=None, cache=cache, limiter=None, retries=5, backoff=0.5):
+    """aiohttp version of cached_get; only requests that actually hit the network wait on the limiter."""
+    import aiohttp
+    entry = cache.load(url, params)
+    if entry is not None and cache.is_fresh(entry, params):
+        return entry['body']
+    headers = cache.validators(entry) if entry is not None else {}
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            await limiter.wait()
+        try:
+            async with session.get(url, params=params, headers=headers) as response:
+                if response.status == 304 and entry is not None:
+                    cache.save(url, params, entry['etag'], entry['last_modified'], entry['body'])
+                    return entry['body']
+                if response.status not in RETRY_STATUSES or attempt == retries:
+                    response.raise_for_status()
+                    body = await response.json()
+                    cache.save(url, params, response.headers.get('ETag'), response.headers.get('Last-Modified'), body)
+                    return body
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == retries:
+                raise
+        await asyncio.sleep(backoff * 2 ** attempt)
+
+def fetch_data(target_date_str, cache=cache):
+    """Fetches data from Federal Register API for a specific date, following every page."""
+    # Pages are requested by number rather than through next_page_url, so they share cache
+    # entries with the concurrent backfill.
+    data = dict(cached_get(API_URL, query_params(target_date_str), cache=cache))
+    results = list(data.get('results', []))
+    page_number, next_page_url = 1, data.get('next_page_url')
+    while next_page_url:
+        page_number += 1
+        page = cached_get(API_URL, query_params(target_date_str, page_number), cache=cache)
+        results.extend(page.get('results', []))
+        next_page_url = page.get('next_page_url')
+    data['results'] = results
+    return data
+
+def process_data(target_date_str: str, cache=cache):
     """Fetches and processes federal register data for a specific date."""
     try:
-        data = fetch_data(target_date_str)
+        data = fetch_data(target_date_str, cache)
         if not data:
             return []
     except requests.exceptions.RequestException as e:
         print(f"Failed to fetch data for {target_date_str}: {e}")
         return []
-    
+    return records_from_results(data.get('results', []))
+
+def records_from_results(results):
+    """Turns Federal Register API results into Atlas records."""
     records_to_upload = []
-    results = data.get('results', [])
     for doc in results:
         doc_abstract = doc.get('abstract')
         doc_title = doc.get('title')
@@ -55,26 +193,204 @@ def process_data(target_date_str: str):
         records_to_upload.append(record)
     return records_to_upload
 
-def upload_to_atlas(records):
-    """Uploads processed records to Nomic Atlas."""
+class RateLimiter:
+    """Spaces out request starts so all tasks together stay under `rate` requests per second."""
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def fetch_page_async(session, semaphore, limiter, cache, target_date_str, page):
+    async with semaphore:
+        return await cached_get_async(session, API_URL, query_params(target_date_str, page), cache, limiter)
+
+async def fetch_date_async(session, semaphore, limiter, cache, target_date_str):
+    """Fetches every page for one date: the first page says how many more there are."""
+    first = await fetch_page_async(session, semaphore, limiter, cache, target_date_str, 1)
+    pages = await asyncio.gather(*[
+        fetch_page_async(session, semaphore, limiter, cache, target_date_str, page)
+        for page in range(2, (first.get('total_pages') or 1) + 1)
+    ])
+    results = list(first.get('results', []))
+    for page in pages:
+        results.extend(page.get('results', []))
+    return results
+
+async def backfill_async(start_date, end_date, concurrency, requests_per_second, cache=cache):
+    import aiohttp
+    dates = [(start_date + timedelta(days=i)).isoformat() for i in range((end_date - start_date).days + 1)]
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(requests_per_second)
+    timeout = aiohttp.ClientTimeout(total=60)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        fetched = await asyncio.gather(
+            *[fetch_date_async(session, semaphore, limiter, cache, d) for d in dates],
+            return_exceptions=True,
+        )
+    records_to_upload, failed_dates = [], []
+    for target_date_str, results in zip(dates, fetched):
+        if isinstance(results, Exception):
+            print(f"Failed to fetch data for {target_date_str}: {results!r}")
+            failed_dates.append(target_date_str)
+            continue
+        records_to_upload.extend(records_from_results(results))
+    return records_to_upload, failed_dates
+
+def process_date_range(start_date_str: str, end_date_str: str, concurrency=8, requests_per_second=10, cache=cache):
+    """Fetches and processes federal register data for every date in a range, concurrently.
+    Returns the records and the dates that couldn't be fetched."""
+    return asyncio.run(backfill_async(
+        date.fromisoformat(start_date_str),
+        date.fromisoformat(end_date_str),
+        concurrency,
+        requests_per_second,
+        cache,
+    ))
+
+def last_complete_date(end_date_str, failed_dates):
+    """The last date of a range with no failed date before it. The watermark only moves this
+    far, so a date that failed is fetched again by the next run instead of being skipped."""
+    if not failed_dates:
+        return end_date_str
+    return (date.fromisoformat(min(failed_dates)) - timedelta(days=1)).isoformat()
+
+def content_hash(record):
+    return hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+class SyncState:
+    """Local record of what is already in Atlas: the last synced publication date, a content
+    hash per document_number, and how many records have been added since the last index build."""
+    def __init__(self, path=STATE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (document_number TEXT PRIMARY KEY, content_hash TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+
+    def get(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set(self, key, value):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+
+    def split_changes(self, records):
+        """Splits records into ones never uploaded and ones whose content has changed since."""
+        new, changed = [], []
+        for record in {r['id']: r for r in records}.values():
+            row = self.conn.execute(
+                'SELECT content_hash FROM documents WHERE document_number = ?', (record['id'],)
+            ).fetchone()
+            if row is None:
+                new.append(record)
+            elif row[0] != content_hash(record):
+                changed.append(record)
+        return new, changed
+
+    def mark_uploaded(self, records):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?)',
+                [(r['id'], content_hash(r)) for r in records],
+            )
+            self.conn.execute(
+                "INSERT INTO meta VALUES ('records_since_index', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value",
+                (len(records),),
+            )
+
+def sync_to_atlas(records, state, synced_from, synced_through, index_every_records=5000, index_every_days=7):
+    """Uploads only new or changed records to Nomic Atlas, and rebuilds the index once enough
+    records have built up or the last build is old enough, instead of on every run.
+
+    The last synced date moves to synced_through only if the range synced_from..synced_through
+    joins up with it. A range that starts later would leave a gap the daily run never fetches."""
     from nomic import AtlasDataset
-    if records:
+    new, changed = state.split_changes(records)
+    print(f"{len(new)} new, {len(changed)} changed, {len(records) - len(new) - len(changed)} unchanged records")
+    dataset = None
+    if new or changed:
         dataset = AtlasDataset("nomic/federal_register", unique_id_field="id")
-        dataset.add_data(records)
+        if changed:
+            dataset.delete_data(ids=[r['id'] for r in changed])
+        dataset.add_data(new + changed)
+        state.mark_uploaded(new + changed)
+
+    pending = int(state.get('records_since_index', 0))
+    last_index = state.get('last_index_date')
+    index_due = last_index is None or (date.today() - date.fromisoformat(last_index)).days >= index_every_days
+    if pending and (pending >= index_every_records or index_due):
+        dataset = dataset or AtlasDataset("nomic/federal_register", unique_id_field="id")
         dataset.create_index(indexed_field="title")
+        state.set('records_since_index', 0)
+        state.set('last_index_date', date.today().isoformat())
+
+    last_synced = state.get('last_synced_date')
+    if last_synced is None:
+        state.set('last_synced_date', synced_through)
+    elif synced_through > last_synced:
+        if synced_from <= (date.fromisoformat(last_synced) + timedelta(days=1)).isoformat():
+            state.set('last_synced_date', synced_through)
+        else:
+            print(f"Not moving the last synced date past {last_synced}: {synced_from} leaves a gap before it")
 
 @app.function(
     image=image, 
     secrets=[modal.Secret.from_name("nomic-api-key")], 
-    schedule=modal.Cron("30 20 * * *") # 4:30 PM Eastern Time UTC every day
+    schedule=modal.Cron("30 20 * * *"), # 4:30 PM Eastern Time UTC every day
+    volumes={STATE_DIR: volume},
+    timeout=60 * 60,
 )
-def daily_job():
-    """Modal function that runs daily to fetch and upload Federal Register data."""
+def daily_job(lookback_days: int = LOOKBACK_DAYS):
+    """Modal function that runs daily to fetch and upload new or changed Federal Register data.
+
+    Every date since the last successful sync is fetched, so missed runs catch up by themselves,
+    and the last few already-synced days are re-checked for corrections."""
     import nomic 
     nomic.login(os.environ["NOMIC_API_KEY"])
 
+    state = SyncState()
     yesterday = date.today() - timedelta(days=1)
+    last_synced = state.get('last_synced_date')
+    start = date.fromisoformat(last_synced) - timedelta(days=lookback_days - 1) if last_synced else yesterday
+    start_date_str = min(start, yesterday).strftime('%Y-%m-%d')
     target_date_str = yesterday.strftime('%Y-%m-%d')
-    print(f"Fetching data for: {target_date_str}")
-    processed_records = process_data(target_date_str)
-    upload_to_atlas(processed_records)
+    print(f"Fetching data for: {start_date_str} to {target_date_str}")
+    # The whole window is either new or being re-checked, so nothing is served from the cache unrevalidated
+    processed_records, failed_dates = process_date_range(
+        start_date_str, target_date_str, cache=DiskCache(revalidate_since=start_date_str)
+    )
+    sync_to_atlas(processed_records, state, start_date_str, last_complete_date(target_date_str, failed_dates))
+    volume.commit()
+
+@app.function(
+    image=image,
+    secrets=[modal.Secret.from_name("nomic-api-key")],
+    volumes={STATE_DIR: volume},
+    timeout=60 * 60,
+)
+def backfill_job(start_date: str, end_date: str, concurrency: int = 8, requests_per_second: float = 10):
+    """Modal function that fetches a whole date range at once and uploads it as one batch."""
+    import nomic
+    nomic.login(os.environ["NOMIC_API_KEY"])
+
+    print(f"Backfilling data from {start_date} to {end_date}")
+    recent = (date.today() - timedelta(days=LOOKBACK_DAYS)).isoformat()
+    processed_records, failed_dates = process_date_range(
+        start_date, end_date, concurrency, requests_per_second, DiskCache(revalidate_since=recent)
+    )
+    print(f"Fetched {len(processed_records)} records")
+    if failed_dates:
+        print(f"Failed to fetch {len(failed_dates)} dates; re-run the backfill for: {', '.join(failed_dates)}")
+    sync_to_atlas(processed_records, SyncState(), start_date, last_complete_date(end_date, failed_dates))
+    volume.commit()
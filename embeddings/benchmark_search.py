@@ -0,0 +1,195 @@
+"""
+Benchmarking the Matryoshka search methods
+
+Sweeps full scans, truncated scans and two-stage reranks (and optionally binary
+quantization and IVF) over a fixed query set, and reports for every setting:
+
+    recall@k      against an exact float64 scan
+    qps           single-query throughput, queries issued one at a time
+    batch_qps     throughput when all queries go in as one batch
+    p50_ms/p99_ms single-query latency percentiles
+    peak_rss_mb   peak memory of building and searching the index, over the loaded corpus
+    build_s       time to build the index
+
+Each index is built and searched in a fresh process so that its peak memory is measured on
+its own. Nothing touches the network: the corpus is synthetic, or a cached .npy of embeddings
+(e.g. np.save('wiki100k.npy', wiki100k_embeddings) in the notebook).
+
+    python benchmark_search.py --output results.json
+    python benchmark_search.py --embeddings wiki100k.npy --methods full rerank ivf
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+from matryoshka import MatryoshkaIndex, exact_topk, recall, synthetic_embeddings
+
+METHODS = ('full', 'truncated', 'rerank', 'binary', 'ivf')
+
+
+def build_index(method, embeddings, **options):
+    if method == 'binary':
+        from binary_quantization import BinaryIndex
+        return BinaryIndex(embeddings, **options)
+    if method == 'ivf':
+        from ivf import IVFIndex
+        return IVFIndex(embeddings, **options)
+    return MatryoshkaIndex(embeddings, **options)
+
+
+def plan(args):
+    """Every run is (method, index options, [search options, ...]): one index build, swept
+    over the search settings that can share it."""
+    runs = []
+    workers = {'workers': args.workers}
+    if 'full' in args.methods:
+        runs.append(('full', {'dims': (), **workers}, [{}]))
+    if 'truncated' in args.methods:
+        runs += [('truncated', {'dims': (d,), 'keep_full': False, **workers}, [{'dim': d}]) for d in args.dims]
+    if 'rerank' in args.methods:
+        runs += [('rerank', {'dims': (d,), **workers}, [{'dim': d, 'expand': e} for e in args.expands])
+                 for d in args.rerank_dims]
+    if 'binary' in args.methods:
+        runs += [('binary', {'dim': d}, [{'expand': e} for e in args.expands]) for d in args.rerank_dims]
+    if 'ivf' in args.methods:
+        runs.append(('ivf', {'train_dim': 128}, [{'nprobe': n} for n in args.nprobes]))
+    return runs
+
+
+def reset_peak_rss():
+    """Resets the process's peak RSS to its current RSS, and returns that in MiB.
+
+    ru_maxrss can't be used for this: Linux carries it across execve, so even a freshly
+    spawned worker starts with the parent's peak."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        # Not Linux: peaks will include whatever the process inherited
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(method, index_options, searches, embeddings_path, queries, truth, k):
+    """Builds one index in this (fresh) process and times every search setting on it."""
+    embeddings = np.load(embeddings_path)
+    idle_mb = reset_peak_rss()
+    start = time.perf_counter()
+    index = build_index(method, embeddings, **index_options)
+    build_s = time.perf_counter() - start
+    del embeddings
+
+    results = []
+    for options in searches:
+        index.search(queries[0], k, **options)  # warm up
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            indices, _ = index.search(query, k, **options)
+            latencies.append(time.perf_counter() - start)
+            found.append(indices)
+        start = time.perf_counter()
+        index.search(queries, k, **options)
+        batch_s = time.perf_counter() - start
+        results.append({
+            'method': method,
+            **{key: value for key, value in index_options.items() if key in ('dim', 'dims', 'train_dim', 'workers')},
+            **options,
+            f'recall@{k}': round(recall(found, truth), 4),
+            'qps': round(len(queries) / sum(latencies), 1),
+            'batch_qps': round(len(queries) / batch_s, 1),
+            'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+            'build_s': round(build_s, 2),
+        })
+    peak_mb = peak_rss_mb() - idle_mb
+    for result in results:
+        result['peak_rss_mb'] = round(peak_mb, 1)
+    return results
+
+
+def load_corpus(args):
+    """(embeddings, queries). Queries come from --queries, or are held out of the corpus."""
+    if args.embeddings:
+        embeddings = np.load(args.embeddings, mmap_mode='r')
+    else:
+        embeddings = synthetic_embeddings(args.rows + args.num_queries, args.dim, seed=args.seed)
+    if args.queries:
+        return np.asarray(embeddings, dtype=np.float32), np.load(args.queries).astype(np.float32)
+    held_out = np.zeros(len(embeddings), dtype=bool)
+    held_out[np.random.default_rng(args.seed).choice(len(embeddings), args.num_queries, replace=False)] = True
+    return np.asarray(embeddings[~held_out], dtype=np.float32), np.asarray(embeddings[held_out], dtype=np.float32)
+
+
+def describe(result, k):
+    settings = ' '.join(f"{key}={value}" for key, value in result.items()
+                        if key in ('dim', 'expand', 'nprobe') and value is not None)
+    return (f"{result['method']:>9} {settings:<22} recall@{k} {result[f'recall@{k}']:.3f}  "
+            f"{result['qps']:8.1f} qps  {result['batch_qps']:8.1f} batch qps  "
+            f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  {result['peak_rss_mb']:7.1f} MiB")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--embeddings", help="Cached (rows, dim) .npy to search instead of synthetic data")
+    parser.add_argument("--queries", help="Query .npy; by default --num-queries rows are held out")
+    parser.add_argument("--rows", type=int, default=100_000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=768, help="Synthetic dimension")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--methods", nargs='+', choices=METHODS, default=['full', 'truncated', 'rerank'])
+    parser.add_argument("--dims", type=int_list, default=[64, 128, 256, 512], help="Truncated scan dimensions")
+    parser.add_argument("--rerank-dims", type=int_list, default=[64, 256], help="First-stage dimensions")
+    parser.add_argument("--expands", type=int_list, default=[2, 5, 10, 20], help="Rerank expand factors")
+    parser.add_argument("--nprobes", type=int_list, default=[1, 4, 16, 64])
+    parser.add_argument("--workers", type=int, default=1, help="Scan threads for full/truncated/rerank")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    embeddings, queries = load_corpus(args)
+    truth = exact_topk(embeddings, queries, args.k)
+    report = {
+        'config': {
+            'corpus': args.embeddings or 'synthetic', 'rows': len(embeddings), 'dim': embeddings.shape[1],
+            'queries': len(queries), 'k': args.k, 'seed': args.seed, 'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+        },
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        embeddings_path = os.path.join(tmp, 'embeddings.npy')
+        np.save(embeddings_path, embeddings)
+        del embeddings
+        for method, index_options, searches in plan(args):
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results = pool.submit(run, method, index_options, searches, embeddings_path,
+                                      queries, truth, args.k).result()
+            for result in results:
+                print(describe(result, args.k), file=sys.stderr)
+            report['results'] += results
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
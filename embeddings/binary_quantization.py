@@ -0,0 +1,126 @@
+"""
+Binary-quantized first-stage search with a float rerank for Matryoshka embeddings
+
+Each (optionally truncated) embedding is reduced to the signs of its dimensions, packed 64 to
+a uint64 word: 96 bytes for a 768-d vector instead of 3072 as float32. Candidates are ranked
+by Hamming distance, computed with XOR and popcount, and the best k * expand of them are
+rescored with float vectors (full or truncated, float32/float16/int8).
+
+The words are stored word-major, (words, rows), so a query's distances are built up one
+contiguous word column at a time instead of reducing over a short axis for every row.
+
+    from binary_quantization import BinaryIndex
+    index = BinaryIndex(wiki100k_embeddings, dim=768, rerank_dim=768)
+    indices, scores = index.search(queries, k=10, expand=10)
+
+Run this file for recall@10 and QPS on 100k synthetic 768-d vectors, the notebook's setup:
+    python binary_quantization.py
+"""
+from argparse import ArgumentParser
+import time
+import numpy as np
+from matryoshka import (MatryoshkaIndex, exact_topk, merge_topk, normalize, quantize, recall,
+                        rerank_rows, synthetic_embeddings, topk)
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    # numpy < 2.0 has no popcount ufunc, so count bits a byte at a time with a lookup table
+    BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        return BYTE_POPCOUNT[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+def pack_signs(x):
+    """Packs the sign bit of every dimension into uint64 words, zero-padded to a whole word."""
+    bits = np.asarray(x) > 0
+    padding = -bits.shape[1] % 64
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.packbits(bits, axis=1).view(np.uint64)
+
+
+class BinaryIndex:
+    def __init__(self, embeddings, dim=None, rerank_dim=None, rerank_dtype='float32', block_rows=65536):
+        embeddings = np.asarray(embeddings)
+        self.dim = dim or embeddings.shape[1]
+        self.codes = np.ascontiguousarray(pack_signs(embeddings[:, :self.dim]).T)
+        self.block_rows = block_rows
+        # rerank_dtype=None keeps only the bits, for a Hamming-only index
+        self.rerank_dim = rerank_dim or embeddings.shape[1]
+        self.rerank_matrix, self.rerank_scale = (None, None) if rerank_dtype is None else \
+            quantize(normalize(embeddings[:, :self.rerank_dim]), rerank_dtype)
+
+    def __len__(self):
+        return self.codes.shape[1]
+
+    def nbytes(self):
+        """Memory used by the candidate stage (the packed bits) and by the rerank vectors."""
+        return self.codes.nbytes, 0 if self.rerank_matrix is None else self.rerank_matrix.nbytes
+
+    def hamming_scan(self, queries, k=10):
+        """Top-k rows by Hamming distance. Returns (indices, distances), nearest first."""
+        codes = pack_signs(np.atleast_2d(queries)[:, :self.dim])
+        indices, scores = [], []
+        for start in range(0, len(self), self.block_rows):
+            block = self.codes[:, start:start + self.block_rows]
+            distances = np.zeros((len(codes), block.shape[1]), dtype=np.int16)
+            for q, code in enumerate(codes):
+                for word, column in zip(code, block):
+                    distances[q] += popcount(column ^ word)
+            block_indices, block_scores = topk(-distances, k)
+            indices.append(block_indices + start)
+            scores.append(block_scores)
+        indices, scores = merge_topk(indices, scores, k)
+        return indices, -scores
+
+    def search(self, queries, k=10, expand=10):
+        """Top-k rows for one query or a batch. With expand, the k * expand nearest rows by
+        Hamming distance are reranked by cosine similarity on the float vectors; without it
+        (or without rerank vectors), scores are negated Hamming distances."""
+        single = np.ndim(queries) == 1
+        if expand is None or self.rerank_matrix is None:
+            indices, distances = self.hamming_scan(queries, k)
+            scores = -distances
+        else:
+            candidates, _ = self.hamming_scan(queries, k * expand)
+            rerank_queries = normalize(np.atleast_2d(queries)[:, :self.rerank_dim])
+            if self.rerank_scale is not None:
+                rerank_queries = rerank_queries * self.rerank_scale
+            indices, scores = rerank_rows(self.rerank_matrix, rerank_queries, candidates, k)
+        return (indices[0], scores[0]) if single else (indices, scores)
+
+
+def measure(search, queries, truth, k):
+    start = time.perf_counter()
+    found, _ = search(queries)
+    qps = len(queries) / (time.perf_counter() - start)
+    return recall(found, truth), qps
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    data = synthetic_embeddings(args.rows + args.queries, args.dim)
+    embeddings, queries = data[:args.rows], data[args.rows:]
+    truth = exact_topk(embeddings, queries, args.k)
+
+    print(f"{'method':<34} {'first stage':>11} {'recall@' + str(args.k):>9} {'qps':>8}")
+    baseline = MatryoshkaIndex(embeddings, dims=())
+    r, qps = measure(lambda q: baseline.search(q, args.k), queries, truth, args.k)
+    print(f"{'float32 full scan':<34} {baseline.nbytes() / 2**20:>7.1f} MiB {r:>9.3f} {qps:>8.0f}")
+    del baseline
+
+    for dim in sorted({args.dim, 512, 256}, reverse=True):
+        index = BinaryIndex(embeddings, dim=dim)
+        for expand in [None, 10, 20]:
+            name = f"binary {dim}d" + (f" + float32 rerank x{expand}" if expand else " hamming only")
+            r, qps = measure(lambda q: index.search(q, args.k, expand), queries, truth, args.k)
+            print(f"{name:<34} {index.nbytes()[0] / 2**20:>7.1f} MiB {r:>9.3f} {qps:>8.0f}")
+        del index
@@ -0,0 +1,235 @@
+"""
+A memory-mapped on-disk store for large Matryoshka embedding corpora
+
+    from embedding_store import EmbeddingStore
+    store = EmbeddingStore('wiki_store')
+    store.append(chunk_of_embeddings, ids=chunk_of_ids)   # once per chunk, as they're embedded
+    indices, scores = store.search(queries, k=10, dim=256, expand=10)
+    store.ids_for(indices)
+
+The store is a directory of append-only shards, one per append() call. A shard is three files:
+
+    00000.emb        64-byte header (magic, dtype, dim, count), then the embeddings
+                     dimension-major: all rows' dimension 0, then all rows' dimension 1, ...
+    00000.ids.npy    the id of every row
+    00000.norms.npy  each row's norm over the first 32, 64, 128, ... dimensions and over all of them
+
+Opening a store only reads headers and memory-maps the files, so startup is instant and
+nothing is copied. Because the layout is dimension-major, a scan over the first d dimensions
+reads only the first d columns' worth of each shard from disk, and the stored prefix norms
+let it renormalize without touching the rest. File-backed pages can always be reclaimed by
+the kernel; release() also drops them from this process's resident set right away.
+
+Run this file to build a synthetic store shard by shard and search it:
+    python embedding_store.py wiki_store --rows 1000000 --shard-rows 250000
+"""
+from argparse import ArgumentParser
+import mmap
+import os
+from pathlib import Path
+import resource
+import struct
+import time
+import numpy as np
+from matryoshka import merge_topk, normalize, recall, synthetic_embeddings, topk
+
+MAGIC = b'MTRYEMB1'
+# magic, dtype string (e.g. b'<f4'), dimension, count; padded to HEADER_SIZE so data is aligned
+HEADER = struct.Struct('<8s8sIQ')
+HEADER_SIZE = 64
+DTYPES = ('float32', 'float16')
+
+
+def norm_dims(dim):
+    """The prefix lengths whose row norms are stored with each shard."""
+    return sorted({d for d in (32, 64, 128, 256, 512, 1024) if d < dim} | {dim})
+
+
+class Shard:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            magic, dtype, self.dim, self.count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not an embedding store shard")
+        self.dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        self.columns = np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_SIZE,
+                                 shape=(self.dim, self.count))
+        stem = self.path.with_suffix('')
+        self.ids = np.load(f"{stem}.ids.npy", mmap_mode='r')
+        self.norms = np.load(f"{stem}.norms.npy", mmap_mode='r')
+        self.norm_rows = {d: i for i, d in enumerate(norm_dims(self.dim))}
+
+    @staticmethod
+    def write(path, embeddings, ids, dtype):
+        """Writes a complete shard. The .emb file is renamed into place last, so a shard only
+        exists once all three files do."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        count, dim = embeddings.shape
+        stem = Path(path).with_suffix('')
+        np.save(f"{stem}.ids.npy", ids)
+        squares = np.cumsum(np.square(embeddings, dtype=np.float64), axis=1)
+        np.save(f"{stem}.norms.npy", np.sqrt(squares[:, [d - 1 for d in norm_dims(dim)]].T).astype(np.float32))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, np.dtype(dtype).str.encode(), dim, count).ljust(HEADER_SIZE, b'\0'))
+            np.ascontiguousarray(embeddings.T, dtype=dtype).tofile(f)
+        os.replace(tmp_path, path)
+
+    def prefix_norms(self, d, start, end):
+        if d in self.norm_rows:
+            return self.norms[self.norm_rows[d], start:end]
+        block = np.asarray(self.columns[:d, start:end], dtype=np.float32)
+        return np.sqrt(np.einsum('dn,dn->n', block, block))
+
+    def release(self):
+        """Drops this shard's pages from the process's resident set. They stay in the page
+        cache, so touching them again is a cheap minor fault rather than a disk read."""
+        self.columns._mmap.madvise(mmap.MADV_DONTNEED)
+
+
+class EmbeddingStore:
+    def __init__(self, path, dtype='float32', block_rows=65536):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}, not {dtype!r}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.block_rows = block_rows
+        self.shards = [Shard(p) for p in sorted(self.path.glob('*.emb'))]
+        self.dtype = self.shards[0].dtype if self.shards else np.dtype(dtype)
+        self.dim = self.shards[0].dim if self.shards else None
+        self.offsets = np.cumsum([0] + [s.count for s in self.shards])
+        self._id_rows = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def append(self, embeddings, ids=None):
+        """Adds a chunk of row-major embeddings as a new shard. Ids default to row numbers."""
+        embeddings = np.asarray(embeddings)
+        if len(embeddings) == 0:
+            return
+        if self.dim is not None and embeddings.shape[1] != self.dim:
+            raise ValueError(f"this store holds {self.dim}-d embeddings, not {embeddings.shape[1]}-d")
+        ids = np.arange(len(self), len(self) + len(embeddings)) if ids is None else np.asarray(ids)
+        if ids.dtype.hasobject or len(ids) != len(embeddings):
+            raise ValueError("ids must be a numeric or string array with one id per embedding")
+        path = self.path / f"{len(self.shards):05d}.emb"
+        Shard.write(path, embeddings, ids, self.dtype)
+        self.shards.append(Shard(path))
+        self.dim = embeddings.shape[1]
+        self.offsets = np.append(self.offsets, len(self) + len(embeddings))
+        self._id_rows = None
+
+    def ids_for(self, indices):
+        """Maps global row indices (as returned by search) to the stored ids."""
+        indices = np.asarray(indices)
+        shard_numbers = np.searchsorted(self.offsets, indices, side='right') - 1
+        return np.array([self.shards[s].ids[i - self.offsets[s]]
+                         for s, i in zip(shard_numbers.ravel(), indices.ravel())]).reshape(indices.shape)
+
+    def index_of(self, id):
+        """The global row index of a stored id. The id -> row mapping is built on first use."""
+        if self._id_rows is None:
+            self._id_rows = {}
+            for shard, offset in zip(self.shards, self.offsets):
+                self._id_rows.update((key, offset + row) for row, key in enumerate(shard.ids.tolist()))
+        return self._id_rows[id]
+
+    def scan(self, queries, k=10, dim=None, release=False):
+        """Cosine top-k over the first dim dimensions. Returns global (indices, scores)."""
+        d = dim or self.dim
+        queries = normalize(np.atleast_2d(queries)[:, :d])
+        indices, scores = [], []
+        for shard, offset in zip(self.shards, self.offsets):
+            for start in range(0, shard.count, self.block_rows):
+                end = min(start + self.block_rows, shard.count)
+                block = np.asarray(shard.columns[:d, start:end], dtype=np.float32)
+                block_scores = (queries @ block) / np.maximum(shard.prefix_norms(d, start, end), 1e-12)
+                block_indices, block_scores = topk(block_scores, k)
+                indices.append(block_indices + offset + start)
+                scores.append(block_scores)
+            if release:
+                shard.release()
+        return merge_topk(indices, scores, k)
+
+    def rows(self, indices, dim=None, release=False):
+        """Normalized (len(indices), dim) float32 rows. Gathers cut across every column, so
+        they're meant for small candidate sets rather than scans."""
+        d = dim or self.dim
+        indices = np.asarray(indices).ravel()
+        out = np.empty((len(indices), d), dtype=np.float32)
+        shard_numbers = np.searchsorted(self.offsets, indices, side='right') - 1
+        for s in np.unique(shard_numbers):
+            mask = shard_numbers == s
+            local = indices[mask] - self.offsets[s]
+            out[mask] = self.shards[s].columns[:d, local].T
+            if release:
+                self.shards[s].release()
+        return normalize(out)
+
+    def search(self, queries, k=10, dim=None, expand=None, release=False):
+        """Top-k for one query or a batch, scanning dim dimensions and, with expand, reranking
+        k * expand candidates at the full dimension.
+
+        With release, each shard's pages are dropped as soon as it's done with, which bounds
+        the resident set by one shard."""
+        single = np.ndim(queries) == 1
+        if expand is None or dim is None:
+            indices, scores = self.scan(queries, k, dim, release)
+        else:
+            candidates, _ = self.scan(queries, k * expand, dim, release)
+            full = normalize(np.atleast_2d(queries))
+            rows = self.rows(candidates, release=release).reshape(*candidates.shape, self.dim)
+            best, scores = topk(np.matmul(rows, full[:, :, None])[:, :, 0], k)
+            indices = np.take_along_axis(candidates, best, axis=1)
+        return (indices[0], scores[0]) if single else (indices, scores)
+
+    def release(self):
+        for shard in self.shards:
+            shard.release()
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * mmap.PAGESIZE / 2**20
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("path", help="Store directory, created and filled if empty")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--shard-rows", type=int, default=250_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--dtype", choices=DTYPES, default='float32')
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--release", action="store_true", help="Drop each shard's pages after use")
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.path, args.dtype)
+    if len(store) == 0:
+        # Written one shard at a time, so building never holds more than a shard in memory
+        for shard_number, start in enumerate(range(0, args.rows, args.shard_rows)):
+            count = min(args.shard_rows, args.rows - start)
+            store.append(synthetic_embeddings(count, args.dim, seed=shard_number),
+                         ids=[f"doc-{i}" for i in range(start, start + count)])
+            print(f"Wrote {start + count}/{args.rows} rows", end="\r")
+        print()
+    del store
+
+    start = time.perf_counter()
+    store = EmbeddingStore(args.path)
+    print(f"Opened {len(store)} x {store.dim} {store.dtype} rows in {len(store.shards)} shards "
+          f"in {(time.perf_counter() - start) * 1000:.1f} ms, RSS {rss_mb():.0f} MiB")
+
+    queries = synthetic_embeddings(args.queries, store.dim, seed=10_000)
+    truth, _ = store.scan(queries, args.k, release=True)
+    for dim, expand in [(64, None), (256, None), (64, 10), (256, 10)]:
+        start = time.perf_counter()
+        found, _ = store.search(queries, args.k, dim, expand, args.release)
+        qps = len(queries) / (time.perf_counter() - start)
+        print(f"dim={dim:>4} expand={expand or '-':>2}: recall@{args.k} {recall(found, truth):.3f}  "
+              f"{qps:7.1f} qps  RSS {rss_mb():.0f} MiB")
+    print(f"Top hit ids for the first query: {store.ids_for(found[0][:3]).tolist()}")
+    print(f"Peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
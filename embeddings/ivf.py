@@ -0,0 +1,170 @@
+"""
+An inverted-file (IVF) index for Matryoshka embeddings
+
+Rows are clustered with k-means on a truncated prefix (128 dimensions by default). A query
+compares its own prefix with the centroids, probes the nprobe closest clusters, and scores
+only their rows at the full dimension. Rows are stored sorted by cluster, so each posting list
+is one contiguous slice of a single matrix. With the default 4 * sqrt(n) clusters a query
+touches roughly nprobe * sqrt(n) / 4 rows instead of n, and nprobe trades recall for latency.
+
+    from ivf import IVFIndex
+    index = IVFIndex(wiki100k_embeddings, train_dim=128)
+    indices, scores = index.search(queries, k=10, nprobe=8)
+    index.save('wiki_ivf')
+    index = IVFIndex.load('wiki_ivf')    # memory-mapped, no retraining
+
+Run this file to sweep nprobe on synthetic embeddings:
+    python ivf.py
+"""
+from argparse import ArgumentParser
+import json
+from pathlib import Path
+import time
+import numpy as np
+from matryoshka import (DTYPES, MatryoshkaIndex, exact_topk, normalize, quantize, recall,
+                        synthetic_embeddings, topk)
+
+
+def nearest_centroids(x, centroids, block_rows=65536):
+    """Index of the most similar centroid for every row of x, in blocks of rows."""
+    return np.concatenate([np.argmax(x[start:start + block_rows] @ centroids.T, axis=1)
+                           for start in range(0, len(x), block_rows)])
+
+
+def kmeans(x, clusters, iterations=20, sample_size=None, seed=0):
+    """Spherical k-means: centroids are renormalized after every update, so assignment is by
+    cosine similarity. Trains on a random sample of rows (50 per cluster by default)."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(x), sample_size or 50 * clusters)
+    clusters = min(clusters, sample_size)
+    sample = x[np.sort(rng.choice(len(x), sample_size, replace=False))]
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)]
+    for _ in range(iterations):
+        assignments = nearest_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=clusters) == 0
+        # Restart empty clusters from random rows rather than letting them die
+        sums[empty] = sample[rng.choice(len(sample), empty.sum(), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, embeddings=None, clusters=None, train_dim=128, dtype='float32',
+                 iterations=20, seed=0):
+        if embeddings is None:
+            # Filled in by load()
+            return
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}, not {dtype!r}")
+        embeddings = np.asarray(embeddings)
+        self.dtype = dtype
+        self.train_dim = min(train_dim, embeddings.shape[1])
+        # Small corpora can't have more clusters than rows
+        clusters = min(clusters or int(4 * np.sqrt(len(embeddings))), len(embeddings))
+        prefixes = normalize(embeddings[:, :self.train_dim])
+        self.centroids = kmeans(prefixes, clusters, iterations, seed=seed)
+        assignments = nearest_centroids(prefixes, self.centroids)
+        del prefixes
+        # Posting lists: rows sorted by cluster, with list c at ids[offsets[c]:offsets[c + 1]]
+        self.ids = np.argsort(assignments, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))])
+        self.vectors, self.scale = quantize(normalize(embeddings[self.ids]), dtype)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def list_sizes(self):
+        return np.diff(self.offsets)
+
+    def search(self, queries, k=10, nprobe=8):
+        """Top-k rows for one query or a batch, scoring only the nprobe closest clusters."""
+        single = np.ndim(queries) == 1
+        queries = normalize(np.atleast_2d(queries))
+        probes, _ = topk(normalize(queries[:, :self.train_dim]) @ self.centroids.T, nprobe)
+        full = queries if self.scale is None else queries * self.scale
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, (query, lists) in enumerate(zip(full, probes)):
+            # Each posting list is a contiguous slice, so it's scored in place without a gather
+            slices = [(self.offsets[c], self.offsets[c + 1]) for c in lists]
+            rows = np.concatenate([np.arange(start, end) for start, end in slices])
+            if len(rows) == 0:
+                continue
+            row_scores = np.concatenate([np.asarray(self.vectors[start:end], dtype=np.float32) @ query
+                                         for start, end in slices])
+            best, best_scores = topk(row_scores[None, :], k)
+            indices[q, :best.shape[1]] = self.ids[rows[best[0]]]
+            scores[q, :best.shape[1]] = best_scores[0]
+        return (indices[0], scores[0]) if single else (indices, scores)
+
+    def save(self, path):
+        """Writes the index as .npy files in a directory, so load() can memory-map them."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ['centroids', 'ids', 'offsets', 'vectors']:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        if self.scale is not None:
+            np.save(path / "scale.npy", self.scale)
+        (path / "meta.json").write_text(json.dumps({'train_dim': self.train_dim, 'dtype': self.dtype}))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = Path(path)
+        index = cls()
+        meta = json.loads((path / "meta.json").read_text())
+        index.train_dim, index.dtype = meta['train_dim'], meta['dtype']
+        # The centroids and offsets are small and read on every query, so they're loaded fully
+        index.centroids = np.load(path / "centroids.npy")
+        index.offsets = np.load(path / "offsets.npy")
+        index.ids = np.load(path / "ids.npy", mmap_mode='r' if mmap else None)
+        index.vectors = np.load(path / "vectors.npy", mmap_mode='r' if mmap else None)
+        index.scale = np.load(path / "scale.npy") if (path / "scale.npy").exists() else None
+        return index
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--train-dim", type=int, default=128)
+    parser.add_argument("--clusters", type=int, help="Defaults to 4 * sqrt(rows)")
+    parser.add_argument("--dtype", choices=DTYPES, default='float32')
+    parser.add_argument("--save", help="Also save the index here and check it reloads identically")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    data = synthetic_embeddings(args.rows + args.queries, args.dim)
+    embeddings, queries = data[:args.rows], data[args.rows:]
+    truth = exact_topk(embeddings, queries, args.k)
+
+    full_scan = MatryoshkaIndex(embeddings, dims=())
+    start = time.perf_counter()
+    full_scan.search(queries, args.k)
+    print(f"full scan: {len(queries) / (time.perf_counter() - start):.0f} qps")
+    del full_scan
+
+    start = time.perf_counter()
+    index = IVFIndex(embeddings, args.clusters, args.train_dim, args.dtype)
+    sizes = index.list_sizes()
+    print(f"Trained {len(sizes)} clusters on {index.train_dim}-d prefixes in {time.perf_counter() - start:.1f}s "
+          f"(list sizes {sizes.min()}-{sizes.max()}, median {int(np.median(sizes))})")
+
+    for nprobe in [1, 2, 4, 8, 16, 32, 64]:
+        start = time.perf_counter()
+        found, _ = index.search(queries, args.k, nprobe)
+        qps = len(queries) / (time.perf_counter() - start)
+        scanned = np.mean([sizes[lists].sum() for lists in topk(
+            normalize(queries[:, :index.train_dim]) @ index.centroids.T, nprobe)[0]])
+        print(f"nprobe={nprobe:>3}: recall@{args.k} {recall(found, truth):.3f}  {qps:7.0f} qps  "
+              f"{scanned / len(index):6.1%} of rows scored")
+
+    if args.save:
+        index.save(args.save)
+        start = time.perf_counter()
+        loaded = IVFIndex.load(args.save)
+        load_ms = (time.perf_counter() - start) * 1000
+        same = all(np.array_equal(a, b) for a, b in zip(index.search(queries, args.k), loaded.search(queries, args.k)))
+        print(f"Reloaded from {args.save} in {load_ms:.1f} ms, identical results: {same}")
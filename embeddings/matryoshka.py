@@ -0,0 +1,230 @@
+"""
+Search over Matryoshka embeddings, packaged up from 00_matryoshka_search_renorm.ipynb
+
+    from matryoshka import MatryoshkaIndex
+    index = MatryoshkaIndex(wiki100k_embeddings, dims=(256, 512))
+    indices, scores = index.search(queries, k=10)                  # full-dimension scan
+    indices, scores = index.search(queries, k=10, dim=256)         # truncated scan
+    indices, scores = index.search(queries, k=10, dim=256, expand=10)  # truncated scan + full rerank
+
+Every truncated prefix is renormalized into its own matrix, so the full-dimension embeddings
+used for reranking are never touched. Queries can be a single vector or a (n, dim) batch,
+which is scored with one matrix product per block of rows, and top-k selection uses
+argpartition instead of sorting every score.
+
+With workers > 1 the row blocks become shards scored on a thread pool (NumPy releases the
+GIL in BLAS calls and in argpartition), each keeping only its own top k before the merge.
+Results are the same as a single-threaded scan. Running with OPENBLAS_NUM_THREADS=1 (or
+OMP_NUM_THREADS=1) stops BLAS's own threads from competing with the shards.
+
+Run this file to check recall against an exact float64 scan on synthetic embeddings:
+    python matryoshka.py
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+import numpy as np
+
+DTYPES = ('float32', 'float16', 'int8')
+
+
+def normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def topk(scores, k):
+    """(indices, scores) of the k highest scores in each row, best first."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+def merge_topk(indices, scores, k):
+    """Merges per-block (indices, scores) top-k results into one top-k."""
+    best, best_scores = topk(np.concatenate(scores, axis=1), k)
+    return np.take_along_axis(np.concatenate(indices, axis=1), best, axis=1), best_scores
+
+
+def quantize(matrix, dtype):
+    """Stores a normalized float32 matrix as float32, float16 or int8.
+
+    int8 uses one scale per dimension, which folds into the query at search time, so scores
+    never need a dequantized copy of the whole matrix. Returns (stored, scale or None)."""
+    if dtype == 'int8':
+        scale = np.maximum(np.abs(matrix).max(axis=0), 1e-12) / 127
+        return np.round(matrix / scale).astype(np.int8), scale.astype(np.float32)
+    return matrix.astype(dtype), None
+
+
+def rerank_rows(matrix, queries, candidates, k):
+    """Scores each query against only its own (n, c) candidate rows of matrix, with one
+    batched matmul over the gathered rows, and keeps the best k."""
+    rows = np.asarray(matrix[candidates.ravel()], dtype=np.float32).reshape(*candidates.shape, -1)
+    scores = np.matmul(rows, queries[:, :, None])[:, :, 0]
+    best, best_scores = topk(scores, k)
+    return np.take_along_axis(candidates, best, axis=1), best_scores
+
+
+class MatryoshkaIndex:
+    def __init__(self, embeddings, dims=(256,), dtype='float32', block_rows=32768, keep_full=True,
+                 workers=1):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}, not {dtype!r}")
+        embeddings = np.asarray(embeddings)
+        self.dim = embeddings.shape[1]
+        self.dtype = dtype
+        self.block_rows = block_rows
+        self.workers = workers
+        self._executor = None
+        # One separately normalized copy per prefix length, plus the full dimension unless
+        # keep_full=False (truncated scans only, no full scans or reranking)
+        dims = {*dims, self.dim} if keep_full else set(dims)
+        self.matrices = {d: quantize(normalize(embeddings[:, :d]), dtype) for d in sorted(dims)}
+
+    def __len__(self):
+        return len(next(iter(self.matrices.values()))[0])
+
+    def nbytes(self):
+        return sum(m.nbytes for m, _ in self.matrices.values())
+
+    def _queries(self, queries, d):
+        queries = normalize(np.atleast_2d(queries)[:, :d])
+        scale = self.matrices[d][1]
+        return queries if scale is None else queries * scale
+
+    def shards(self, rows):
+        """(start, end) row ranges: blocks of at most block_rows, and at least one per worker so
+        that a single query is spread over every core too."""
+        shard_rows = max(1, min(self.block_rows, -(-rows // self.workers)))
+        return [(start, min(start + shard_rows, rows)) for start in range(0, rows, shard_rows)]
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers)
+        return self._executor
+
+    def scan(self, queries, k=10, dim=None):
+        """Exhaustive top-k over the dim-prefix matrix, one shard of rows at a time.
+
+        Shards keep the (queries x rows) score matrix small and are where float16 and int8
+        rows get cast to float32 for BLAS."""
+        d = dim or self.dim
+        if d not in self.matrices:
+            raise KeyError(f"no {d}-dimensional prefix in this index, it has {sorted(self.matrices)}")
+        matrix = self.matrices[d][0]
+        queries = self._queries(queries, d)
+
+        def scan_shard(shard):
+            start, end = shard
+            block = np.asarray(matrix[start:end], dtype=np.float32)
+            indices, scores = topk(queries @ block.T, k)
+            return indices + start, scores
+
+        shards = self.shards(len(matrix))
+        if self.workers > 1 and len(shards) > 1:
+            results = list(self._pool().map(scan_shard, shards))
+        else:
+            results = [scan_shard(shard) for shard in shards]
+        indices, scores = zip(*results)
+        return merge_topk(indices, scores, k)
+
+    def rerank(self, queries, candidates, k=10, dim=None):
+        """Rescores each query's candidate rows at dim (full by default) and keeps the top k."""
+        d = dim or self.dim
+        return rerank_rows(self.matrices[d][0], self._queries(queries, d), candidates, k)
+
+    def search(self, queries, k=10, dim=None, expand=None):
+        """Top-k rows for one query or a batch of queries.
+
+        With dim, the scan uses that prefix. With expand as well, it collects k * expand
+        candidates from the prefix and reranks them at the full dimension."""
+        single = np.ndim(queries) == 1
+        if expand is None or dim is None:
+            indices, scores = self.scan(queries, k, dim)
+        else:
+            candidates, _ = self.scan(queries, k * expand, dim)
+            indices, scores = self.rerank(queries, candidates, k)
+        return (indices[0], scores[0]) if single else (indices, scores)
+
+
+def exact_topk(embeddings, queries, k=10):
+    """Brute-force float64 cosine top-k, the ground truth for recall."""
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+    scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ \
+        (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).T
+    return topk(scores, k)[0]
+
+
+def recall(found, truth):
+    """Mean fraction of each query's true top-k that was found."""
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def synthetic_embeddings(n, dim=768, clusters=1000, seed=0):
+    """Clustered unit vectors whose variance decays with dimension, so that leading
+    dimensions carry the most information the way they do in Matryoshka embeddings.
+
+    The cluster centers are the same for every seed, so a large corpus can be generated in
+    chunks with different seeds."""
+    centers = np.random.default_rng(0).standard_normal((clusters, dim), dtype=np.float32)
+    rng = np.random.default_rng([1, seed])
+    x = centers[rng.integers(clusters, size=n)] + 0.7 * rng.standard_normal((n, dim), dtype=np.float32)
+    x *= 1 / np.sqrt(1 + np.arange(dim, dtype=np.float32) / 32)
+    return normalize(x)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Threads for the sharded scan check")
+    args = parser.parse_args()
+
+    data = synthetic_embeddings(args.rows + args.queries, args.dim)
+    embeddings, queries = data[:args.rows], data[args.rows:]
+    truth = exact_topk(embeddings, queries, args.k)
+
+    # Minimum recall against the exact scan for (dim, expand). int8 rounding costs a little
+    # recall on every path, so it gets some slack.
+    checks = {(None, None): 0.99, (256, None): 0.5, (256, 10): 0.97, (64, 10): 0.8}
+    slack = {'float32': 0, 'float16': 0, 'int8': 0.03}
+    failures = 0
+    for dtype in DTYPES:
+        index = MatryoshkaIndex(embeddings, dims=(64, 256), dtype=dtype)
+        print(f"{dtype}: {index.nbytes() / 2**20:.0f} MiB")
+        for (dim, expand), minimum in checks.items():
+            minimum -= slack[dtype]
+            start = time.perf_counter()
+            found, _ = index.search(queries, args.k, dim, expand)
+            qps = len(queries) / (time.perf_counter() - start)
+            r = recall(found, truth)
+            failures += r < minimum
+            status = "ok" if r >= minimum else f"FAIL, expected >= {minimum}"
+            print(f"  dim={dim or args.dim:>4} expand={expand or '-':>2}: recall@{args.k} {r:.3f}  {qps:8.0f} qps  ({status})")
+
+    # The sharded scan has to return exactly what the single-threaded one does
+    serial = MatryoshkaIndex(embeddings, dims=(64, 256))
+    sharded = MatryoshkaIndex(embeddings, dims=(64, 256), workers=args.workers)
+    print(f"{args.workers} workers vs 1:")
+    for dim, expand in checks:
+        timings = []
+        for index in [serial, sharded]:
+            start = time.perf_counter()
+            single = [index.search(query, args.k, dim, expand)[0] for query in queries]
+            latency_ms = (time.perf_counter() - start) / len(queries) * 1000
+            start = time.perf_counter()
+            batch, _ = index.search(queries, args.k, dim, expand)
+            timings.append((np.array(single), batch, latency_ms, len(queries) / (time.perf_counter() - start)))
+        (serial_single, serial_batch, serial_ms, serial_qps), (single, batch, ms, qps) = timings
+        same = np.array_equal(serial_single, single) and np.array_equal(serial_batch, batch)
+        failures += not same
+        print(f"  dim={dim or args.dim:>4} expand={expand or '-':>2}: {serial_ms:6.2f} -> {ms:6.2f} ms/query, "
+              f"{serial_qps:6.0f} -> {qps:6.0f} batch qps  ({'same results' if same else 'FAIL, results differ'})")
+    raise SystemExit(failures)
@@ -0,0 +1,117 @@
+"""
+Load generator for search_server.py: throughput against tail latency
+
+Runs closed-loop clients (each sends its next query as soon as the last one returns) at
+increasing concurrency and reports throughput, p50/p99 latency and the mean batch size the
+service formed. By default the service runs in this process with the local stand-in encoder,
+swept over batch settings; max_batch_size=1 is the unbatched baseline.
+
+    python search_load.py --concurrency 1,8,32,128 --batch-sizes 1,16,64
+    python search_load.py --url http://localhost:8080    # against a running search_server.py
+"""
+from argparse import ArgumentParser
+import asyncio
+import itertools
+import json
+import time
+import aiohttp
+import numpy as np
+from search_server import SearchService, add_service_arguments, load_index, make_encoder
+
+
+async def closed_loop(send, concurrency, duration):
+    """Runs concurrency clients for duration seconds. Returns the latency of every request."""
+    latencies = []
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await send(f"query {next(counter)}")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies
+
+
+def summarize(latencies, duration, **settings):
+    return {
+        **settings,
+        'requests': len(latencies),
+        'throughput_qps': round(len(latencies) / duration, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 2),
+    }
+
+
+async def run_in_process(args, index, encoder):
+    results = []
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrency:
+            service = SearchService(index, encoder, batch_size, args.max_wait_ms / 1000,
+                                    args.k, args.search_dim, args.expand)
+            await service.start()
+            start = time.perf_counter()
+            latencies = await closed_loop(service.search, concurrency, args.duration)
+            duration = time.perf_counter() - start
+            await service.close()
+            results.append(summarize(latencies, duration, max_batch_size=batch_size,
+                                     max_wait_ms=args.max_wait_ms, concurrency=concurrency,
+                                     mean_batch_size=round(service.requests / max(service.batches, 1), 1)))
+            print_result(results[-1])
+    return results
+
+
+async def run_against(args):
+    results = []
+    for concurrency in args.concurrency:
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def send(text):
+                async with session.get(f"{args.url}/search", params={'q': text}) as response:
+                    response.raise_for_status()
+                    return await response.json()
+
+            async with session.get(f"{args.url}/stats") as response:
+                before = await response.json()
+            start = time.perf_counter()
+            latencies = await closed_loop(send, concurrency, args.duration)
+            duration = time.perf_counter() - start
+            async with session.get(f"{args.url}/stats") as response:
+                after = await response.json()
+        batches = max(after['batches'] - before['batches'], 1)
+        results.append(summarize(latencies, duration, concurrency=concurrency,
+                                 mean_batch_size=round((after['requests'] - before['requests']) / batches, 1)))
+        print_result(results[-1])
+    return results
+
+
+def print_result(result):
+    settings = ' '.join(f"{key}={result[key]}" for key in ('max_batch_size', 'concurrency') if key in result)
+    print(f"{settings:<34} {result['throughput_qps']:8.1f} qps  p50 {result['p50_ms']:8.2f} ms  "
+          f"p99 {result['p99_ms']:8.2f} ms  mean batch {result['mean_batch_size']}")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    add_service_arguments(parser)
+    parser.add_argument("--url", help="Load a running search_server.py instead of an in-process service")
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 16, 64])
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per setting")
+    parser.add_argument("--output", help="Also write the results here as JSON")
+    args = parser.parse_args()
+
+    if args.url:
+        results = asyncio.run(run_against(args))
+    else:
+        results = asyncio.run(run_in_process(args, load_index(args), make_encoder(args)))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,199 @@
+"""
+A micro-batching search service around the Matryoshka scanners
+
+Calling embed_query and then rr_256d for every request costs one embedding round trip and one
+matrix-vector product per query. SearchService instead queues concurrent requests, waits at
+most max_wait for up to max_batch_size of them, embeds the whole batch in one call and scores
+it with one matrix-matrix product. Under load batches fill up on their own; when it's quiet a
+request waits no longer than max_wait.
+
+    service = SearchService(MatryoshkaIndex(embeddings, dims=(256,)), NomicEncoder())
+    await service.start()
+    indices, scores = await service.search("tree data structures")
+
+Serve it over HTTP (GET /search?q=...), with a local stand-in encoder so nothing calls out:
+    python search_server.py --encoder local --max-batch-size 64 --max-wait-ms 5
+
+and drive it with search_load.py.
+"""
+from argparse import ArgumentParser
+import asyncio
+import hashlib
+import numpy as np
+from aiohttp import web
+from matryoshka import MatryoshkaIndex, synthetic_embeddings
+
+
+class NomicEncoder:
+    """Embeds queries with the Nomic API, one embed.text call per batch."""
+
+    def __init__(self, model="nomic-embed-text-v1.5"):
+        import nomic.embed as embed
+        self.embed = embed
+        self.model = model
+
+    async def encode(self, texts):
+        output = await asyncio.to_thread(self.embed.text, texts, model=self.model, task_type="search_query")
+        return np.array(output['embeddings'], dtype=np.float32)
+
+
+class LocalEncoder:
+    """A stand-in for the embedding API. Texts map to fixed pseudo-random vectors, and each
+    call sleeps like a round trip: call_latency, plus per_text_latency for every text."""
+
+    def __init__(self, dim=768, call_latency=0.02, per_text_latency=0.0002):
+        self.dim = dim
+        self.call_latency = call_latency
+        self.per_text_latency = per_text_latency
+
+    async def encode(self, texts):
+        await asyncio.sleep(self.call_latency + self.per_text_latency * len(texts))
+        seeds = [int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'little') for text in texts]
+        return np.stack([np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32) for seed in seeds])
+
+
+class SearchService:
+    def __init__(self, index, encoder, max_batch_size=64, max_wait=0.005, k=10, dim=256, expand=10):
+        self.index = index
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.k = k
+        self.dim = dim
+        self.expand = expand
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.requests = 0
+        self._task = None
+        self._batch = []
+        self.closed = False
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Fail the batch that was in flight and everything still queued, so no caller waits forever
+        pending = [future for _, future in self._batch]
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait()[1])
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("search service closed"))
+        self._batch = []
+
+    async def search(self, text):
+        """(indices, scores) of the top k rows for one query text."""
+        if self.closed:
+            raise RuntimeError("search service closed")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            # Callers that gave up (e.g. disconnected HTTP clients) don't need embedding
+            batch = [(text, future) for text, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            self._batch = batch
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                queries = await self.encoder.encode([text for text, _ in batch])
+                # Scoring runs off the event loop, so new requests keep queueing meanwhile
+                indices, scores = await asyncio.to_thread(self.index.search, queries, self.k, self.dim, self.expand)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), i, s in zip(batch, indices, scores):
+                if not future.done():
+                    future.set_result((i, s))
+
+
+def make_app(service):
+    async def search(request):
+        query = request.query.get('q')
+        if not query:
+            raise web.HTTPBadRequest(text="missing ?q=")
+        indices, scores = await service.search(query)
+        return web.json_response({'indices': indices.tolist(), 'scores': scores.tolist()})
+
+    async def stats(request):
+        return web.json_response({'requests': service.requests, 'batches': service.batches,
+                                  'mean_batch_size': service.requests / max(service.batches, 1)})
+
+    async def start(app):
+        await service.start()
+
+    async def stop(app):
+        await service.close()
+
+    app = web.Application()
+    app.router.add_get('/search', search)
+    app.router.add_get('/stats', stats)
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    return app
+
+
+def load_index(args):
+    embeddings = np.load(args.embeddings) if args.embeddings else synthetic_embeddings(args.rows, args.dim)
+    return MatryoshkaIndex(embeddings, dims=(args.search_dim,), workers=args.workers)
+
+
+def make_encoder(args):
+    if args.encoder == 'nomic':
+        return NomicEncoder()
+    return LocalEncoder(args.dim, args.call_latency_ms / 1000, args.per_text_latency_ms / 1000)
+
+
+def add_service_arguments(parser):
+    parser.add_argument("--embeddings", help="(rows, dim) .npy to search instead of synthetic data")
+    parser.add_argument("--rows", type=int, default=100_000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--search-dim", type=int, default=256, help="First-stage dimension")
+    parser.add_argument("--expand", type=int, default=10)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1, help="Scan threads")
+    parser.add_argument("--encoder", choices=['local', 'nomic'], default='local')
+    parser.add_argument("--call-latency-ms", type=float, default=20, help="Local encoder round trip")
+    parser.add_argument("--per-text-latency-ms", type=float, default=0.2, help="Local encoder cost per text")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    add_service_arguments(parser)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    service = SearchService(load_index(args), make_encoder(args), args.max_batch_size,
+                            args.max_wait_ms / 1000, args.k, args.search_dim, args.expand)
+    web.run_app(make_app(service), port=args.port)
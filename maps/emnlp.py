@@ -1,28 +1,31 @@
+import asyncio
+import atexit
+from collections import deque
 import json
+import os
+import sqlite3
+import time
+import aiohttp
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 
-def get_links(url, base_url):
-    """Fetch the content of the web page and extract links."""
-    response = requests.get(url)
-    response.raise_for_status()
-
-    soup = BeautifulSoup(response.content, 'html.parser')
+def parse_links(soup, base_url):
+    """Extract every link from a parsed page."""
     a_tags = soup.find_all('a')
-    
+
     # Resolve relative links
     links = [urljoin(base_url, a['href']) for a in a_tags if a.has_attr('href')]
-    
+
     return links
 
-def extract_paper_details(target_url):
-    # Fetch the content of the URL
-    response = requests.get(target_url)
+def get_links(url, base_url):
+    """Fetch the content of the web page and extract links."""
+    response = requests.get(url)
     response.raise_for_status()
+    return parse_links(BeautifulSoup(response.content, 'html.parser'), base_url)
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-
+def parse_paper_details(soup):
     # Extracting Title
     title = soup.find('h2', id="title").a.text
 
@@ -48,13 +51,14 @@ def extract_paper_details(target_url):
 
     return details
 
-def get_strong_links(url):
-    """Fetch the content of the web page and extract links within <strong> tags."""
-    response = requests.get(url)
+def extract_paper_details(target_url):
+    # Fetch the content of the URL
+    response = requests.get(target_url)
     response.raise_for_status()
+    return parse_paper_details(BeautifulSoup(response.content, 'html.parser'))
 
-    soup = BeautifulSoup(response.content, 'html.parser')
-
+def parse_strong_links(soup, url):
+    """Extract links within <strong> tags of a parsed page."""
     # Find all <strong> tags that contain <a> tags
     strong_tags = soup.find_all('strong')
 
@@ -68,44 +72,404 @@ def get_strong_links(url):
 
     return links
 
+def get_strong_links(url):
+    """Fetch the content of the web page and extract links within <strong> tags."""
+    response = requests.get(url)
+    response.raise_for_status()
+    return parse_strong_links(BeautifulSoup(response.content, 'html.parser'), url)
+
+class SoupParser:
+    """Parser backend built on BeautifulSoup: the reference implementation above.
+
+    features='html.parser' is pure Python; features='lxml' keeps the same BeautifulSoup tree but
+    builds it with lxml's much faster C tokenizer."""
+    def __init__(self, features='html.parser'):
+        self.features = features
+
+    def parse(self, html):
+        return BeautifulSoup(html, self.features)
+
+    def links(self, doc, base_url):
+        return parse_links(doc, base_url)
+
+    def strong_links(self, doc, url):
+        return parse_strong_links(doc, url)
+
+    def paper_details(self, doc):
+        return parse_paper_details(doc)
+
+def dl_fields(pairs):
+    """Maps each <dt> label of a paper's details list to its <dd>, from one pass over the list."""
+    fields = {}
+    label = None
+    for tag, node in pairs:
+        if tag == 'dt':
+            label = node
+        elif tag == 'dd' and label is not None:
+            fields.setdefault(label, node)
+            label = None
+    return fields
+
+class LxmlParser:
+    """Parser backend using lxml.html and XPath directly, with no BeautifulSoup tree at all."""
+    def __init__(self):
+        import lxml.html
+        self.html = lxml.html
+
+    def parse(self, html):
+        if isinstance(html, bytes):
+            return self.html.document_fromstring(html, parser=self.html.HTMLParser(encoding='utf-8'))
+        return self.html.document_fromstring(html)
+
+    def links(self, doc, base_url):
+        return [urljoin(base_url, href) for href in doc.xpath('//a/@href')]
+
+    def strong_links(self, doc, url):
+        return [urljoin(url, href) for href in doc.xpath('//strong//a/@href')]
+
+    def paper_details(self, doc):
+        title = doc.xpath('//h2[@id="title"]/a')[0].text_content()
+        authors = [a.text_content() for a in doc.xpath('//p[contains(concat(" ", normalize-space(@class), " "), " lead ")]//a')]
+        fields = dl_fields(
+            (node.tag, node.text_content() if node.tag == 'dt' else node)
+            for node in doc.xpath('//dt | //dd')
+        )
+        year = fields['Year:'].text_content() if 'Year:' in fields else None
+        url_links = fields['URL:'].xpath('.//a/@href') if 'URL:' in fields else []
+        url = url_links[0] if url_links else None
+        return {"Title": title, "Authors": authors, "Publication Year": year, "URL": url}
+
+class SelectolaxParser:
+    """Parser backend using selectolax's CSS selectors over the lexbor C parser: the fastest of
+    the three, and it only ever walks the handful of nodes each selector matches."""
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self.parser = LexborHTMLParser
+
+    def parse(self, html):
+        return self.parser(html)
+
+    def links(self, doc, base_url):
+        return [urljoin(base_url, a.attributes['href']) for a in doc.css('a[href]')]
+
+    def strong_links(self, doc, url):
+        return [urljoin(url, a.attributes['href']) for a in doc.css('strong a[href]')]
+
+    def paper_details(self, doc):
+        title = doc.css_first('h2#title > a').text()
+        authors = [a.text() for a in doc.css('p.lead a')]
+        fields = dl_fields((node.tag, node.text() if node.tag == 'dt' else node) for node in doc.css('dt, dd'))
+        year = fields['Year:'].text() if 'Year:' in fields else None
+        url_link = fields['URL:'].css_first('a') if 'URL:' in fields else None
+        url = url_link.attributes.get('href') if url_link is not None else None
+        return {"Title": title, "Authors": authors, "Publication Year": year, "URL": url}
+
+PARSERS = {
+    'html.parser': lambda: SoupParser('html.parser'),
+    'lxml': LxmlParser,
+    'soup-lxml': lambda: SoupParser('lxml'),
+    'selectolax': SelectolaxParser,
+}
+
+def get_parser(name='html.parser'):
+    """Returns a parser backend by name; all of them produce the same links and paper dicts."""
+    return PARSERS[name]()
+
+class JsonlSink:
+    """Long-lived, buffered, deduplicating JSONL writer.
+
+    Records are buffered and written out together once `flush_every` have built up or
+    `flush_interval` seconds have passed since the last write to disk, and when the sink is
+    closed. Writes only check the interval when they arrive, so long-running callers should
+    also call `flush_if_due()` periodically (Crawler runs a timer task for this). `durability`
+    says how far a flush goes: 'os' hands the data to the operating system (survives the
+    process crashing), 'fsync' also forces it onto the disk (survives a power cut).
+
+    Records whose `key` field is already in the file are skipped: the keys of existing lines are
+    loaded when the sink opens, so re-running a crawl into the same file doesn't duplicate it.
+    A partial last line with no newline, left by a crash in the middle of a write, is truncated
+    away then; complete lines that aren't valid JSON are skipped with a warning and left as is.
+    `on_flush` is called after each flush, once the buffered records are durable."""
+    def __init__(self, filename="emnlp.jsonl", key="URL", flush_every=100, flush_interval=5.0, durability="os",
+                 on_flush=None):
+        if durability not in ("os", "fsync"):
+            raise ValueError(f"durability must be 'os' or 'fsync', not {durability!r}")
+        self.key = key
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.on_flush = on_flush
+        self.keys = set()
+        if os.path.exists(filename):
+            self._load_keys(filename)
+        self.keys.discard(None)
+        self.file = open(filename, "a", encoding="utf-8")
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.skipped = 0
+
+    def _load_keys(self, filename):
+        size = 0
+        partial = None
+        with open(filename, "rb") as f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith(b"\n"):
+                    # Only the last line can lack its newline
+                    partial = line
+                    break
+                size += len(line)
+                if line.strip():
+                    try:
+                        self.keys.add(json.loads(line).get(self.key))
+                    except json.JSONDecodeError:
+                        print(f"Skipping line {number} of {filename}: not valid JSON")
+        if partial is None:
+            return
+        try:
+            record = json.loads(partial)
+        except json.JSONDecodeError:
+            print(f"Truncating a partial record at the end of {filename}")
+            with open(filename, "r+b") as f:
+                f.truncate(size)
+            return
+        # A whole record that's only missing its newline: end the line so appends don't join it
+        self.keys.add(record.get(self.key))
+        with open(filename, "ab") as f:
+            f.write(b"\n")
+
+    def write(self, data):
+        key = data.get(self.key)
+        if key is not None:
+            if key in self.keys:
+                self.skipped += 1
+                return False
+            self.keys.add(key)
+        self.buffer.append(json.dumps(data, ensure_ascii=False) + "\n")
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+        else:
+            self.flush_if_due()
+        return True
+
+    def flush_if_due(self):
+        if self.buffer and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("".join(self.buffer))
+            self.buffer = []
+        self.file.flush()
+        if self.durability == "fsync":
+            os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+        if self.on_flush is not None:
+            self.on_flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_sinks = {}
+
 def save_to_jsonl(data, filename="emnlp.jsonl"):
-    """Appends data to a JSONL file."""
-    with open(filename, "a", encoding="utf-8") as f:
-        json_string = json.dumps(data, ensure_ascii=False)
-        f.write(json_string + "\n")
+    """Appends data to a JSONL file, unless a record with the same URL is already in it.
+
+    Every file gets one long-lived JsonlSink, so its existing keys are read once rather than
+    on every call. Records are buffered like any JsonlSink's; close_sinks() writes out the rest
+    and runs at exit."""
+    sink = _sinks.get(filename)
+    if sink is None:
+        sink = _sinks[filename] = JsonlSink(filename)
+    sink.write(data)
+
+@atexit.register
+def close_sinks():
+    for sink in _sinks.values():
+        sink.close()
+    _sinks.clear()
+
+class CrawlStore:
+    """SQLite record of a crawl: the frontier still to visit, the pages already visited, and the
+    paper pages already extracted. An interrupted crawl reloads it and carries on from there."""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (url TEXT PRIMARY KEY, depth INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS visited (url TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS papers (url TEXT PRIMARY KEY);
+        """)
+
+    def load(self):
+        frontier = self.conn.execute('SELECT url, depth FROM frontier ORDER BY rowid').fetchall()
+        visited = {url for url, in self.conn.execute('SELECT url FROM visited')}
+        papers = {url for url, in self.conn.execute('SELECT url FROM papers')}
+        return frontier, visited, papers
 
-def process_page(url):
+    def add_frontier(self, links):
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO frontier VALUES (?, ?)', links)
+
+    def mark_visited(self, url, new_links):
+        """Moves a page from the frontier to visited and queues its links, all in one step."""
+        with self.conn:
+            self.conn.execute('DELETE FROM frontier WHERE url = ?', (url,))
+            self.conn.execute('INSERT OR IGNORE INTO visited VALUES (?)', (url,))
+            self.conn.executemany('INSERT OR IGNORE INTO frontier VALUES (?, ?)', new_links)
+
+    def mark_papers(self, urls):
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO papers VALUES (?)', [(url,) for url in urls])
+
+class Crawler:
+    """Breadth-first crawler that fetches pages concurrently over pooled keep-alive connections.
+
+    At most `concurrency` requests are in flight overall and `per_host` against any one host.
+    The crawl stops after `limit` pages, and links more than `max_depth` hops from the start
+    page aren't followed. By default only links on the start page's host are followed.
+
+    Progress is kept in a CrawlStore at `store_path`; if it already holds a crawl, that crawl
+    is resumed instead of starting over. Use ':memory:' for a crawl that isn't saved.
+
+    `parser` names the HTML parser backend (see PARSERS) used for every page. Papers go to a
+    JsonlSink on `output`, and only count as extracted in the store once the sink has flushed
+    them, so a crash never loses a paper the store thinks is saved. For the same reason a page
+    is only marked visited after the papers it found have been flushed."""
+    def __init__(self, start_url, process_page, limit=10, max_depth=2, concurrency=16, per_host=8, same_host=True,
+                 store_path='emnlp_crawl.sqlite', parser='html.parser', output='emnlp.jsonl'):
+        self.process_page = process_page
+        self.parser = get_parser(parser)
+        self.limit = limit
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host = urlparse(start_url).netloc if same_host else None
+        self.store = CrawlStore(store_path)
+        frontier, visited, papers = self.store.load()
+        if not frontier and not visited:
+            frontier = [(start_url, 0)]
+            self.store.add_frontier(frontier)
+        self.frontier = deque(frontier)
+        # Every URL that has been queued or fetched, so nothing is ever fetched twice.
+        self.seen = visited | {url for url, _ in frontier} | papers
+        self.pages = len(visited)
+        self.in_progress = 0
+        self.unflushed_papers = []
+        self.sink = JsonlSink(output, on_flush=self.papers_flushed)
+
+    def papers_flushed(self):
+        self.store.mark_papers(self.unflushed_papers)
+        self.unflushed_papers = []
+
+    def save_paper(self, url, details):
+        self.unflushed_papers.append(url)
+        self.sink.write(details)
+
+    async def fetch(self, url):
+        """Returns the page body, or None for anything that isn't HTML (PDFs, BibTeX, ...)."""
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            if response.content_type != 'text/html':
+                return None
+            return await response.read()
+
+    async def crawl(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        # No total timeout: requests queued behind the connection limits can wait a while.
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
+            self.changed = asyncio.Condition()
+            flusher = asyncio.create_task(self.flush_periodically())
+            try:
+                await asyncio.gather(*[self.worker() for _ in range(self.concurrency)])
+            finally:
+                flusher.cancel()
+                self.sink.close()
+
+    async def flush_periodically(self):
+        # Papers trickling in slower than flush_every still reach the disk every flush_interval.
+        while True:
+            await asyncio.sleep(self.sink.flush_interval)
+            self.sink.flush_if_due()
+
+    async def worker(self):
+        while True:
+            async with self.changed:
+                # An empty frontier only means we're done once nobody else can add to it.
+                while not self.frontier and self.in_progress:
+                    await self.changed.wait()
+                if not self.frontier or self.pages >= self.limit:
+                    self.changed.notify_all()
+                    return
+                url, depth = self.frontier.popleft()
+                self.pages += 1
+                self.in_progress += 1
+            try:
+                await self.visit(url, depth)
+            except Exception as e:
+                print('\t', 'failed on: ', url, e)
+            finally:
+                async with self.changed:
+                    self.in_progress -= 1
+                    self.changed.notify_all()
+
+    async def visit(self, url, depth):
+        # Each page is fetched and parsed once; the same tree is used for processing and links.
+        html = await self.fetch(url)
+        new_links = []
+        if html is not None:
+            doc = self.parser.parse(html)
+            await self.process_page(self, url, doc)
+            if depth < self.max_depth:
+                for link in self.parser.links(doc, url):
+                    link = link.split('#')[0]
+                    if link in self.seen or (self.host and urlparse(link).netloc != self.host):
+                        continue
+                    self.seen.add(link)
+                    new_links.append((link, depth + 1))
+        # A resumed crawl never revisits this page, so its papers must be on disk first.
+        if self.sink.buffer:
+            self.sink.flush()
+        self.store.mark_visited(url, new_links)
+        self.frontier.extend(new_links)
+
+async def process_page(crawler, url, doc):
     """A function to process each fetched page."""
-    # For demonstration, just print the URL, but you can do more complex actions here
+    # EMNLP event pages list every paper in <strong> tags; fetch those concurrently. Papers
+    # saved by an earlier (possibly interrupted) run are skipped.
     if 'emnlp' in url and 'event' in url:
-        sl = get_strong_links(url)
-        for l in sl:
+        async def process_paper(l):
             print(f"Processing page: {l}")
             try:
-                d = extract_paper_details(l)
-                save_to_jsonl(d)
+                paper_html = await crawler.fetch(l)
+                crawler.save_paper(l, crawler.parser.paper_details(crawler.parser.parse(paper_html)))
             except Exception as e:
                 print('\t', 'failed on: ', l)
 
-
+        papers = [l for l in crawler.parser.strong_links(doc, url) if l not in crawler.seen]
+        crawler.seen.update(papers)
+        await asyncio.gather(*[process_paper(l) for l in papers])
 
     # E.g., extract data, save content, etc.
 
-def crawl_website(start_url, limit=10):
-    """Crawl the website starting from the given URL."""
-    visited = set()
-    to_visit = [start_url]
-
-    while to_visit:
-        current_url = to_visit.pop(0)
-        
-        if current_url not in visited:
-            process_page(current_url)
-            visited.add(current_url)
-
-            for link in get_links(current_url, current_url):
-                if link not in visited:
-                    to_visit.append(link)
+def crawl_website(start_url, limit=10, max_depth=2, concurrency=16, per_host=8, store_path='emnlp_crawl.sqlite',
+                  parser='html.parser', output='emnlp.jsonl'):
+    """Crawl the website starting from the given URL, resuming a crawl saved at store_path."""
+    crawler = Crawler(start_url, process_page, limit, max_depth, concurrency, per_host,
+                      store_path=store_path, parser=parser, output=output)
+    asyncio.run(crawler.crawl())
+    return crawler.pages
 
 if __name__ == "__main__":
-    crawl_website(start_url='https://aclanthology.org/venues/emnlp/')
+    # The venue page links to every EMNLP event page, which in turn lists every paper.
+    crawl_website(start_url='https://aclanthology.org/venues/emnlp/', limit=1000, max_depth=1)
@@ -0,0 +1,85 @@
+"""
+Benchmarking the HTML parser backends in emnlp.py on saved ACL Anthology pages
+
+First save some pages to a fixtures directory (an EMNLP event page and its paper pages):
+    python emnlp_parser_benchmark.py anthology_fixtures --save-from https://aclanthology.org/events/emnlp-2023/ --count 200
+
+Then run every installed backend over them:
+    python emnlp_parser_benchmark.py anthology_fixtures
+
+Each backend has to produce exactly the same links and paper dicts as html.parser, the
+reference backend, before its pages/sec is reported.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+import time
+import requests
+from emnlp import PARSERS, get_parser, parse_strong_links
+from bs4 import BeautifulSoup
+
+BASE_URL = 'https://aclanthology.org/'
+
+def save_fixtures(directory, event_url, count):
+    directory.mkdir(parents=True, exist_ok=True)
+    session = requests.Session()
+    response = session.get(event_url)
+    response.raise_for_status()
+    (directory / 'event.html').write_bytes(response.content)
+    paper_urls = parse_strong_links(BeautifulSoup(response.content, 'html.parser'), event_url)[:count]
+    for i, url in enumerate(paper_urls):
+        response = session.get(url)
+        response.raise_for_status()
+        (directory / f'paper_{i:05d}.html').write_bytes(response.content)
+        print(f"Saved {i + 1}/{len(paper_urls)}", end="\r")
+    print()
+
+def extract(parser, html):
+    """Everything the crawler pulls out of a page."""
+    doc = parser.parse(html)
+    try:
+        details = parser.paper_details(doc)
+    except (AttributeError, IndexError, TypeError):
+        # Not a paper page
+        details = None
+    return parser.links(doc, BASE_URL), parser.strong_links(doc, BASE_URL), details
+
+def benchmark(pages, name, repeat):
+    try:
+        parser = get_parser(name)
+    except ImportError as e:
+        print(f"{name:>12}: skipped ({e})")
+        return None
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [extract(parser, html) for html in pages]
+        best = min(best, time.perf_counter() - start)
+    return outputs, len(pages) / best
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("fixtures", type=Path, help="Directory of saved Anthology .html pages")
+    parser.add_argument("--save-from", help="Event page URL to download fixtures from first")
+    parser.add_argument("--count", type=int, default=200, help="Paper pages to save with --save-from")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.save_from:
+        save_fixtures(args.fixtures, args.save_from, args.count)
+    pages = [path.read_bytes() for path in sorted(args.fixtures.glob('*.html'))]
+    print(f"{len(pages)} pages from {args.fixtures}")
+
+    # html.parser is always installed, so it's run first and the others are checked against it
+    reference = None
+    for name in ['html.parser', *(name for name in PARSERS if name != 'html.parser')]:
+        result = benchmark(pages, name, args.repeat)
+        if result is None:
+            continue
+        outputs, pages_per_second = result
+        if reference is None:
+            reference = outputs
+        mismatches = sum(output != expected for output, expected in zip(outputs, reference))
+        if mismatches:
+            print(f"{name:>12}: not reported, {mismatches} pages differ from html.parser")
+        else:
+            print(f"{name:>12}: {pages_per_second:8.1f} pages/sec")
@@ -0,0 +1,108 @@
+import io
+import random
+import tarfile
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pyarrow as pa
+
+import enron_to_parquet as etp
+
+# This script compares the two ways enron_to_parquet.py can turn e-mails into Arrow batches:
+# the original email.parser -> dict -> Table.from_pylist path, and the columnar fast path.
+# It builds a synthetic maildir tarball shaped like the Enron one, so it runs anywhere without
+# the real 400MB download, checks that both paths give identical tables, and prints the timings.
+#
+# $ python benchmark_parsing.py --emails 50000
+
+
+# A synthetic e-mail with the same headers as the Enron corpus, plus the odd folded line, rare
+# header, mbox envelope line (first or further down), differently-cased repeat, header name
+# that isn't printable ASCII and \r line ending that the fast path has to handle the same way
+# email.parser does.
+def synthetic_email(i, rng):
+    headers = [
+        f"Message-ID: <{i}.1075855687451.JavaMail.evans@thyme>",
+        f"Date: {rng.choice(['Mon', 'Tue', 'Wed'])}, {rng.randint(10, 28)} May 2001 16:39:00 -0700 (PDT)",
+        f"From: user{rng.randint(0, 150)}@enron.com",
+        f"To: user{rng.randint(0, 150)}@enron.com,\n\tuser{rng.randint(0, 150)}@enron.com",
+        f"Subject: Re: meeting {rng.randint(0, 5000)}",
+        "Mime-Version: 1.0",
+        "Content-Type: text/plain; charset=us-ascii",
+        "Content-Transfer-Encoding: 7bit",
+        "X-From: Phillip K Allen",
+        "X-To: Tim Belden <Tim Belden/Enron@EnronXGate>",
+        "X-cc: ",
+        "X-bcc: ",
+        "X-Folder: \\Phillip_Allen_Jan2002_1\\Allen, Phillip K.\\'Sent Mail",
+        "X-Origin: Allen-P",
+        "X-FileName: pallen (Non-Privileged).pst",
+    ]
+    if rng.random() < 0.25:
+        headers += ["Cc: someone@enron.com", "Bcc: someone@enron.com"]
+    if rng.random() < 0.01:
+        headers.append("X-Rare-Header: dropped")
+    if rng.random() < 0.01:
+        headers.insert(0, "X-CC: someone@enron.com")
+    if rng.random() < 0.01:
+        headers.insert(0, "From user0@enron.com Mon May 14 16:39:00 2001")
+    if rng.random() < 0.01:
+        headers.insert(rng.randint(1, len(headers)), "From user1@enron.com Mon May 14 16:39:00 2001")
+    if rng.random() < 0.01:
+        headers.insert(rng.randint(1, len(headers)), rng.choice(["S\u00fcbject: umlaut", "X-Ctrl\x01: control"]))
+    body = "Here is our forecast for the week.\n" * rng.randint(1, 60)
+    email = "\n".join(headers) + "\n\n" + body
+    if rng.random() < 0.005:
+        email = email.replace("\n", "\r")
+    return email
+
+
+def make_tarball(path, n, seed=0):
+    rng = random.Random(seed)
+    with tarfile.open(path, "w:gz") as tf:
+        for i in range(n):
+            data = synthetic_email(i, rng).encode("latin-1")
+            info = tarfile.TarInfo(f"maildir/user{i % 150}/{rng.choice(['inbox', 'sent', 'notes/old'])}/{i}.")
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+
+def email_parser_path(emails, schema):
+    parser = etp.email.parser.Parser()
+    buffer = [etp.email_to_dict(user, folder, name, parser.parsestr(txt)) for user, folder, name, txt in emails]
+    return etp.supplement_batch(buffer, schema)
+
+
+def columnar_path(emails, schema):
+    columns = etp.new_columns(schema)
+    for user, folder, name, txt in emails:
+        etp.append_email_columns(columns, user, folder, name, txt)
+    return etp.columns_to_batch(columns, schema)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--emails", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        etp.ZIP_FILE_PATH = str(Path(tmp) / "maildir.tar.gz")
+        make_tarball(etp.ZIP_FILE_PATH, args.emails)
+        # Both paths start from the same decoded text, so we only time the parsing itself.
+        emails = list(etp.raw_emails())
+
+    results = {}
+    for label, fn in [("email.parser", email_parser_path), ("columnar", columnar_path)]:
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tables = [fn(emails[i : i + etp.BATCH_SIZE], etp.schema) for i in range(0, len(emails), etp.BATCH_SIZE)]
+            best = min(best, time.perf_counter() - start)
+        results[label] = pa.concat_tables(tables)
+        print(f"{label:>13}: {best:.2f}s, {len(emails) / best:,.0f} emails/sec")
+
+    assert results["columnar"].equals(results["email.parser"]), "columnar output differs from email.parser"
+    print("Outputs are identical.")
@@ -1,58 +1,190 @@
 import pymongo as pm
+from bson.binary import Binary, BinaryVectorDtype
 from nomic import AtlasProject
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import pandas as pd
+from hashlib import blake2b
+import json
+import os
 from pathlib import Path
 import nomic
 
-# replace with your mongodb connect string / cert
-client = pm.MongoClient('mongodb+srv://cluster0.l3jhqfs.mongodb.net/'
-                        '?authSource=%24external&authMechanism=MONGODB-X509&retryWrites=true&w=majority',
-                        tls=True,
-                        tlsCertificateKeyFile='mongocert.pem')
-
-collection = client.testdb.testcoll
-
-# Delete current content of collection
-collection.delete_many({})
-
-# Load embedding data into mongodb
-mongo_so = pd.read_parquet(Path.cwd() / 'data' / 'mongo-so.parquet')
-model = SentenceTransformer('all-MiniLM-L6-v2')
-title_embeds = model.encode(mongo_so['title'])
-mso_te = mongo_so.assign(title_embedding=list(title_embeds))
-
-data = list(r._asdict() for r in mso_te.itertuples())
-for d in data:
-    del d['Index']
-    d['title_embedding'] = d['title_embedding'].tolist()
-data[0]
-collection.insert_many(data)
-
-# Read a mongodb collection with embeddings in it and map it:
-project = AtlasProject(
-    name='MongoDB Stack Overflow Questions',
-    unique_id_field='mongo_id',
-    reset_project_if_exists=True,
-    is_public=True,
-    modality='embedding',
-)
-
-all_items = list(collection.find())
-embs = np.array([d['title_embedding'] for d in all_items])
-for d in all_items:
-    d['mongo_id'] = str(d['_id'])
-    del d['title_embedding']
-    del d['_id']
-
-project.add_embeddings(all_items, embs)
-
-project.rebuild_maps()
-project.create_index(
-    name='MongoDB Stack Overflow Questions',
-    topic_label_field='body',
-    build_topic_model=True,
-)
-
-print(project)
+# Documents per insert_many call, per cursor round trip, and per add_embeddings upload.
+INSERT_CHUNK_SIZE = 5_000
+CURSOR_BATCH_SIZE = 2_000
+UPLOAD_CHUNK_SIZE = 10_000
+
+# Embeddings are stored as BSON binary vectors (subtype 9, float32): 4 bytes per dimension plus
+# a 2-byte header, instead of the 11-13 a BSON array of doubles takes (a type byte, the index as
+# a key string, then 8 bytes). It's also the format Atlas Vector Search reads natively. Packing
+# and unpacking go through Binary.from_vector / as_vector, which need a recent pymongo 4.x.
+
+
+def to_binary(embedding):
+    return Binary.from_vector(np.asarray(embedding, dtype=np.float32), BinaryVectorDtype.FLOAT32)
+
+
+def from_binary(value):
+    # Collections written by older versions of this script hold plain arrays of doubles
+    if isinstance(value, list):
+        return value
+    return value.as_vector(return_numpy=True).data
+
+
+class EmbeddingCache:
+    """An on-disk cache of sentence embeddings for one model, keyed by a hash of the text.
+
+    The vectors live in one append-only float32 file that is memory-mapped for reads, next to
+    a file of 16-byte text digests in the same row order. Only texts that aren't in the cache
+    yet are encoded, in chunks on a multi-process CPU pool, and each chunk is appended as soon
+    as it's done, so an interrupted run keeps what it already encoded. The model isn't even
+    loaded when everything is cached."""
+
+    def __init__(self, model_name, directory='embedding_cache', workers=os.cpu_count(),
+                 batch_size=256, chunk_size=10_000):
+        self.model_name = model_name
+        self.workers = workers
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.path = Path(directory) / model_name.replace('/', '__')
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.keys_path = self.path / 'keys.bin'
+        self.vectors_path = self.path / 'vectors.f32'
+        self.meta_path = self.path / 'meta.json'
+        self.dimension = json.loads(self.meta_path.read_text())['dimension'] if self.meta_path.exists() else None
+        self.rows = {}
+        self._load()
+
+    @staticmethod
+    def key(text):
+        return blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def _load(self):
+        if self.dimension is None:
+            return
+        keys = self.keys_path.read_bytes() if self.keys_path.exists() else b''
+        vector_bytes = self.vectors_path.stat().st_size if self.vectors_path.exists() else 0
+        # Vectors are written before their keys, so after a crash the two files can disagree;
+        # trim both back to the rows that made it into both.
+        count = min(len(keys) // 16, vector_bytes // (4 * self.dimension))
+        for f, size in [(self.keys_path, count * 16), (self.vectors_path, count * 4 * self.dimension)]:
+            with open(f, 'ab') as handle:
+                handle.truncate(size)
+        self.rows = {keys[16 * i:16 * (i + 1)]: i for i in range(count)}
+
+    def _append(self, keys, embeddings):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.dimension is None:
+            self.dimension = embeddings.shape[1]
+            self.meta_path.write_text(json.dumps({'model': self.model_name, 'dimension': self.dimension}))
+        with open(self.vectors_path, 'ab') as f:
+            f.write(embeddings.tobytes())
+        with open(self.keys_path, 'ab') as f:
+            f.write(b''.join(keys))
+        for key in keys:
+            self.rows[key] = len(self.rows)
+
+    def _encode_missing(self, keys, texts):
+        model = SentenceTransformer(self.model_name, device='cpu')
+        pool = model.start_multi_process_pool(['cpu'] * self.workers) if self.workers > 1 else None
+        try:
+            for start in range(0, len(texts), self.chunk_size):
+                chunk = texts[start:start + self.chunk_size]
+                if pool is not None:
+                    embeddings = model.encode_multi_process(chunk, pool, batch_size=self.batch_size)
+                else:
+                    embeddings = model.encode(chunk, batch_size=self.batch_size)
+                self._append(keys[start:start + self.chunk_size], embeddings)
+                print(f"Encoded {start + len(chunk)}/{len(texts)} new texts", end="\r")
+            print()
+        finally:
+            if pool is not None:
+                model.stop_multi_process_pool(pool)
+
+    def encode(self, texts):
+        """Returns a float32 (len(texts), dimension) array, encoding only the cache misses."""
+        keys = [self.key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.rows:
+                missing.setdefault(key, text)
+        print(f"{len(missing)} of {len(texts)} texts missing from the embedding cache")
+        if missing:
+            self._encode_missing(list(missing), list(missing.values()))
+        if not keys:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.rows), self.dimension))
+        return vectors[np.fromiter((self.rows[key] for key in keys), dtype=np.int64, count=len(keys))]
+
+
+def insert_with_embeddings(collection, df, embeddings, chunk_size=INSERT_CHUNK_SIZE):
+    # Unordered inserts let the server apply each batch without stopping at the first error,
+    # and only one chunk of documents is built as dicts at a time.
+    for start in range(0, len(df), chunk_size):
+        docs = df.iloc[start:start + chunk_size].to_dict('records')
+        for d, embedding in zip(docs, embeddings[start:start + chunk_size]):
+            d['title_embedding'] = to_binary(embedding)
+        collection.insert_many(docs, ordered=False)
+
+
+def stream_embeddings(collection, fields, embedding_field='title_embedding',
+                      chunk_size=UPLOAD_CHUNK_SIZE, batch_size=CURSOR_BATCH_SIZE):
+    """Yields (metadata, float32 embeddings) chunks straight off a cursor.
+
+    The projection only pulls the fields the map needs, and each chunk's embeddings are decoded
+    into one reused float32 buffer, so memory stays flat however big the collection is."""
+    cursor = collection.find({}, projection=[*fields, embedding_field], batch_size=batch_size)
+    items, buffer = [], None
+    for d in cursor:
+        embedding = from_binary(d.pop(embedding_field))
+        if buffer is None:
+            buffer = np.empty((chunk_size, len(embedding)), dtype=np.float32)
+        buffer[len(items)] = embedding
+        d['mongo_id'] = str(d.pop('_id'))
+        items.append(d)
+        if len(items) == chunk_size:
+            yield items, buffer
+            items = []
+    if items:
+        yield items, buffer[:len(items)]
+
+
+if __name__ == "__main__":
+    # replace with your mongodb connect string / cert
+    client = pm.MongoClient('mongodb+srv://cluster0.l3jhqfs.mongodb.net/'
+                            '?authSource=%24external&authMechanism=MONGODB-X509&retryWrites=true&w=majority',
+                            tls=True,
+                            tlsCertificateKeyFile='mongocert.pem')
+
+    collection = client.testdb.testcoll
+
+    # Delete current content of collection
+    collection.delete_many({})
+
+    # Load embedding data into mongodb
+    mongo_so = pd.read_parquet(Path.cwd() / 'data' / 'mongo-so.parquet')
+    # Re-runs only encode titles that weren't embedded before
+    title_embeds = EmbeddingCache('all-MiniLM-L6-v2').encode(mongo_so['title'].tolist())
+    insert_with_embeddings(collection, mongo_so, title_embeds)
+
+    # Read a mongodb collection with embeddings in it and map it:
+    project = AtlasProject(
+        name='MongoDB Stack Overflow Questions',
+        unique_id_field='mongo_id',
+        reset_project_if_exists=True,
+        is_public=True,
+        modality='embedding',
+    )
+
+    for items, embs in stream_embeddings(collection, list(mongo_so.columns)):
+        project.add_embeddings(items, embs)
+
+    project.rebuild_maps()
+    project.create_index(
+        name='MongoDB Stack Overflow Questions',
+        topic_label_field='body',
+        build_topic_model=True,
+    )
+
+    print(project)
@@ -1,31 +1,141 @@
 """
 Visualizing your pinecone vector database index in Atlas
+
+The export lists the index's ids page by page and fetches their vectors in fixed-size batches
+on a pool of threads, so it doesn't need to know the ids ahead of time and works the same for
+the 999-vector demo and for indexes with millions of vectors. Vectors go straight into one
+preallocated float32 matrix, or into a float32 file on disk with --spill.
+
+    python pinecone_index.py --index quickstart --workers 16 --spill quickstart.f32
+
+Listing ids needs a serverless index and pinecone-client 3 or newer.
 """
-import pinecone
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import time
 import numpy as np
+from pinecone import Pinecone, ServerlessSpec
 from nomic import atlas
 import nomic
-pinecone.init(api_key='YOUR PINECONE API KEY', environment='us-east1-gcp')
+
+pc = Pinecone(api_key='YOUR PINECONE API KEY')
 nomic.login('YOUR NOMIC API KEY')
 
-#create and insert embeddings into your pinecone index
-pinecone.create_index("quickstart", dimension=128, metric="euclidean", pod_type="p1")
+# Ids per list page (Pinecone allows up to 100) and ids per fetch request.
+LIST_PAGE_SIZE = 100
+FETCH_BATCH_SIZE = 200
+
+
+def create_demo_index(name, num_embeddings=999, dimension=128):
+    #create and insert embeddings into your pinecone index
+    pc.create_index(name, dimension=dimension, metric="euclidean",
+                    spec=ServerlessSpec(cloud="aws", region="us-east-1"))
+    while not pc.describe_index(name).status['ready']:
+        time.sleep(1)
+    index = pc.Index(name)
+    embeddings_for_pinecone = np.random.rand(num_embeddings, dimension)
+    for start in range(0, num_embeddings, 100):
+        index.upsert([(str(i), embeddings_for_pinecone[i].tolist())
+                      for i in range(start, min(start + 100, num_embeddings))])
+
+
+def id_batches(index, namespace='', batch_size=FETCH_BATCH_SIZE):
+    """Yields every id in the namespace, regrouped from list pages into batches of batch_size."""
+    batch = []
+    for page in index.list(namespace=namespace, limit=LIST_PAGE_SIZE):
+        batch.extend(page)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+
+class VectorMatrix:
+    """A float32 (rows, dimension) matrix filled one fetched batch at a time.
+
+    It's allocated once for the vector count the index reports. If more vectors turn up than
+    that (the index is being written to during the export) it grows, and it's trimmed to the
+    rows actually written at the end. With a spill path the matrix is a memmap of a raw float32
+    file, so the export never needs the vectors to fit in memory."""
+
+    def __init__(self, capacity, dimension, spill=None):
+        self.dimension = dimension
+        self.spill = spill
+        self.rows = 0
+        self.ids = []
+        self.data = self._allocate(max(capacity, 1))
+
+    def _allocate(self, capacity):
+        if self.spill is None:
+            data = np.empty((capacity, self.dimension), dtype=np.float32)
+            if self.rows:
+                data[:self.rows] = self.data[:self.rows]
+            return data
+        if self.rows:
+            self.data.flush()
+            del self.data
+        with open(self.spill, 'r+b' if self.rows else 'w+b') as f:
+            f.truncate(capacity * self.dimension * 4)
+        return np.memmap(self.spill, dtype=np.float32, mode='r+', shape=(capacity, self.dimension))
+
+    def append(self, vectors):
+        if self.rows + len(vectors) > len(self.data):
+            self.data = self._allocate(max(2 * len(self.data), self.rows + len(vectors)))
+        for id, vector in vectors.items():
+            self.data[self.rows] = vector.values
+            self.ids.append(id)
+            self.rows += 1
+
+    def finish(self):
+        if self.spill is None:
+            return self.data[:self.rows]
+        self.data.flush()
+        del self.data
+        with open(self.spill, 'r+b') as f:
+            f.truncate(self.rows * self.dimension * 4)
+        return np.memmap(self.spill, dtype=np.float32, mode='r', shape=(self.rows, self.dimension))
+
+
+def export_vectors(index, namespace='', workers=16, batch_size=FETCH_BATCH_SIZE, spill=None):
+    """Pulls every vector in the namespace out of the index. Returns (ids, float32 matrix)."""
+    stats = index.describe_index_stats()
+    count = stats.namespaces[namespace].vector_count if namespace in stats.namespaces else 0
+    matrix = VectorMatrix(count, stats.dimension, spill)
+
+    # Listing runs ahead of the fetches, but only 2 x workers batches are ever in flight, so
+    # memory stays bounded by the matrix no matter how big the index is.
+    start = time.perf_counter()
+    in_flight = deque()
+    with ThreadPoolExecutor(workers) as pool:
+        for ids in id_batches(index, namespace, batch_size):
+            in_flight.append(pool.submit(index.fetch, ids=ids, namespace=namespace))
+            if len(in_flight) >= 2 * workers:
+                matrix.append(in_flight.popleft().result().vectors)
+                print(f"{matrix.rows}/{count} vectors ({matrix.rows / (time.perf_counter() - start):.0f}/s)", end="\r")
+        while in_flight:
+            matrix.append(in_flight.popleft().result().vectors)
+    print(f"{matrix.rows} vectors exported in {time.perf_counter() - start:.1f}s")
+    return matrix.ids, matrix.finish()
 
-index = pinecone.Index("quickstart")
 
-num_embeddings = 999
-embeddings_for_pinecone = np.random.rand(num_embeddings, 128)
-index.upsert([(str(i), embeddings_for_pinecone[i].tolist()) for i in range(num_embeddings)])
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--index", default="quickstart")
+    parser.add_argument("--namespace", default="")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent fetch requests")
+    parser.add_argument("--batch-size", type=int, default=FETCH_BATCH_SIZE, help="Ids per fetch request")
+    parser.add_argument("--spill", help="Write the vectors to this float32 file instead of memory")
+    args = parser.parse_args()
 
-#now pull the embeddings out of pinecone by id
-vectors = index.fetch(ids=[str(i) for i in range(num_embeddings)])
+    if args.index not in pc.list_indexes().names():
+        create_demo_index(args.index)
 
-ids = []
-embeddings = []
-for id, vector in vectors['vectors'].items():
-    ids.append(id)
-    embeddings.append(vector['values'])
+    # pool_threads sizes the client's connection pool to match the fetch workers
+    index = pc.Index(args.index, pool_threads=args.workers)
 
-embeddings = np.array(embeddings)
+    #now pull the embeddings out of pinecone, without knowing their ids in advance
+    ids, embeddings = export_vectors(index, args.namespace, args.workers, args.batch_size, args.spill)
 
-atlas.map_embeddings(embeddings=embeddings, data=[{'id': id} for id in ids], id_field='id')
+    atlas.map_embeddings(embeddings=embeddings, data=[{'id': id} for id in ids], id_field='id')
@@ -1,4 +1,5 @@
 import weaviate
+from concurrent.futures import ThreadPoolExecutor
 from nomic import AtlasDataset
 import numpy as np
 import nomic
@@ -9,6 +10,10 @@ client = weaviate.Client(
     url="WEAVIATE DATABASE URL",
 )
 
+# Objects per cursor page, and how many classes are exported at the same time.
+BATCH_SIZE = 10000
+MAX_CONCURRENT_CLASSES = 4
+
 schema = client.schema.get()
 
 classes = []
@@ -37,36 +42,56 @@ def get_batch_with_cursor(
         return query.do()
 
 
-for c, p in zip(classes, props):
-    dataset = AtlasDataset(identifier=c, unique_id_field="id")  # Initialize AtlasDataset
+def page_to_arrays(objects):
+    """Splits a page of objects into metadata dicts and a float32 vector matrix.
+
+    The matrix is allocated once at its final size and filled row by row, so the vectors never
+    exist as a float64 array or as one big nested list."""
+    embeddings = np.empty((len(objects), len(objects[0]["_additional"]["vector"])), dtype=np.float32)
+    data = []
+    for row, obj in enumerate(objects):
+        embeddings[row] = obj["_additional"]["vector"]
+        data.append({key: value for key, value in obj.items() if key != "_additional"})
+    return data, embeddings
+
+
+def export_class(client, class_name, class_properties, batch_size=BATCH_SIZE):
+    """Copies one Weaviate class into an Atlas dataset.
 
-    count = 0
-    cursor = None
-    while True:
-        response = get_batch_with_cursor(client, c, p, 10000, cursor)
-        count += 1
-        if len(response["data"]["Get"][c]) == 0:
-            break
-        cursor = response["data"]["Get"][c][-1]["_additional"]["id"]
-        vectors = []
-        data = []
-        for i in response["data"]["Get"][c]:
-            vectors.append(i["_additional"]["vector"])
+    While a page is being converted and uploaded, the next page is already being fetched on a
+    background thread: its cursor is just the last id of the current page, so there's no need
+    to wait for the upload before asking for it."""
+    dataset = AtlasDataset(identifier=class_name, unique_id_field="id")  # Initialize AtlasDataset
 
-            metadata = {key: value for key, value in i.items() if key != "_additional"}
-            data.append(metadata)
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_page = prefetcher.submit(get_batch_with_cursor, client, class_name, class_properties, batch_size)
+        while True:
+            objects = next_page.result()["data"]["Get"][class_name]
+            if len(objects) == 0:
+                break
+            cursor = objects[-1]["_additional"]["id"]
+            next_page = prefetcher.submit(
+                get_batch_with_cursor, client, class_name, class_properties, batch_size, cursor
+            )
 
-        embeddings = np.array(vectors)
-        
-        # Add data to the dataset
-        dataset.add_data(data=data, embeddings=embeddings)
+            data, embeddings = page_to_arrays(objects)
+
+            # Add data to the dataset
+            dataset.add_data(data=data, embeddings=embeddings)
 
     # Create index in the dataset
     index_options = {
-        "indexed_field": p,
+        "indexed_field": class_properties,
         "modality": "embedding",
         "topic_model": True,
         "duplicate_detection": True,
         "embedding_model": "NomicEmbed",
     }
-    dataset.create_index(name=c, **index_options)
+    dataset.create_index(name=class_name, **index_options)
+    return class_name
+
+
+# Several classes are exported at once, so one class's uploads overlap with another's fetches.
+with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CLASSES) as pool:
+    for class_name in pool.map(lambda cp: export_class(client, *cp), zip(classes, props)):
+        print(f"Exported {class_name}")